@@ -0,0 +1 @@
+# The benchmarks, and the synthetic rpyc corpus (see corpus.py) they share with the tests.
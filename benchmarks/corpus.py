@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+
+# Synthetic rpyc corpus for the benchmarks. The ASTs are built from the same fake renpy classes
+# unrpyc unpickles files into, pickled with magic.SafePickler, and laid out the way ren'py (or an
+# obfuscator) writes them. The files are deterministic for a given seed and scale, so timings of
+# different commits can be compared without needing the files of an actual game.
+#
+# usage: python benchmarks/corpus.py OUTPUT_DIR [--scale 1.0] [--seed 0]
+
+import argparse
+import base64
+import io
+import random
+import struct
+import sys
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from decompiler import magic  # noqa: E402
+from decompiler.renpycompat import CLASS_FACTORY  # noqa: E402
+
+
+# The ren'py version recorded in the generated files
+RENPY_VERSION = 8010000
+
+# magic of the obfuscated layout. Anything but b"RENPY RPC2" makes unrpyc give up without
+# --try-harder.
+OBFUSCATED_MAGIC = b"GAME DATA1"
+
+PyExpr = CLASS_FACTORY("PyExpr", "renpy.ast")
+PyCode = CLASS_FACTORY("PyCode", "renpy.ast")
+
+CHARACTERS = (None, "e", "mc", "narrator")
+LINES = (
+    "Hello there.",
+    'She said "hi" and left.',
+    "Wait{w=0.5} for it.",
+    "A line\nwith a break.",
+    "Percentages: 100%% sure.",
+    "{i}Italic{/i} and {b}bold{/b}.",
+    "A rather long line of dialogue, as most of the lines in a visual novel are, which goes on "
+    "for a while before it ends.")
+IMAGES = (("eileen", "happy"), ("eileen", "sad"), ("lucy", "mad"), ("bg", "room"),
+          ("bg", "street"))
+TRANSITIONS = ("dissolve", "fade", "None", "Dissolve(0.5)")
+# words of generated dialogue, see dialogue
+WORDS = tuple(word for line in LINES for word in line.split()) + (
+    "café", "naïve", "…", "日本語", "Ünter", "ça")
+
+
+def node(class_name, module="renpy.ast", /, **attributes):
+    """Returns an instance of the fake class module.class_name with the given attributes."""
+    instance = CLASS_FACTORY(class_name, module)()
+    instance.__dict__.update(attributes)
+    return instance
+
+
+def dialogue(rng):
+    """
+    Returns a line of dialogue of 3 to 20 words, drawn with rng. Some of them contain quotes,
+    line breaks, double spaces or non-ASCII characters, in roughly the amounts games have them.
+    """
+    words = [rng.choice(WORDS) for _ in range(rng.randint(3, 20))]
+    if rng.random() < 0.1:
+        words[0] = '"' + words[0]
+        words[-1] += '"'
+    if rng.random() < 0.05:
+        words[rng.randrange(len(words))] += "\n"
+    if rng.random() < 0.03:
+        words[rng.randrange(len(words))] += " "
+    return " ".join(words)
+
+
+def pycode(source, location, mode="exec"):
+    code = PyCode()
+    code.__setstate__((1, source, location, mode))
+    return code
+
+
+class CorpusPickler(magic.SafePickler):
+    """
+    SafePickler which pickles PyCode the way ren'py does, as the fake PyCode class only knows
+    how to be unpickled.
+    """
+
+    def reducer_override(self, obj):
+        if type(obj) is PyCode:
+            return PyCode, (), (1, obj.source, obj.location, obj.mode)
+        return NotImplemented
+
+
+class ScriptBuilder:
+    """
+    Builds the statements of one file. Line numbers increase as statements are added, so they
+    are in the order a script file would have them.
+    """
+
+    def __init__(self, filename, seed):
+        self.filename = filename
+        self.random = random.Random(f"{seed}:{filename}")
+        self.line = 1
+
+    def next_line(self, count=1):
+        line = self.line
+        self.line += count
+        return line
+
+    def location(self):
+        return (self.filename, self.next_line())
+
+    def expr(self, source):
+        return PyExpr(source, self.filename, self.line)
+
+    def statement(self, class_name, module="renpy.ast", /, **attributes):
+        return node(class_name, module, filename=self.filename, linenumber=self.next_line(),
+                    **attributes)
+
+    # script statements
+
+    def say(self, who=None, interact=True):
+        what = self.random.choice(LINES)
+        return self.statement(
+            "Say", who=who, what=what, with_=None, interact=interact, attributes=None,
+            temporary_attributes=None, arguments=None, identifier=None,
+            explicit_identifier=False, rollback="normal")
+
+    def python(self, source):
+        line = self.next_line()
+        return node("Python", filename=self.filename, linenumber=line, hide=False,
+                    store="store", code=pycode(source, (self.filename, line)))
+
+    def show(self):
+        imspec = (self.random.choice(IMAGES), None, None, [], None, None, [])
+        return self.statement("Show", imspec=imspec, atl=None)
+
+    def scene(self):
+        imspec = (self.random.choice(IMAGES), None, None, [], "master", None, [])
+        return self.statement("Scene", imspec=imspec, layer="master", atl=None)
+
+    def with_(self):
+        return self.statement("With", expr=self.random.choice(TRANSITIONS), paired=None)
+
+    def jump(self, target):
+        return self.statement("Jump", target=target, expression=False)
+
+    def if_(self, depth, max_depth, size):
+        line = self.next_line()
+        entries = [(PyExpr(f"points > {depth}", self.filename, line),
+                    self.block(depth + 1, max_depth, size))]
+        self.next_line()
+        entries.append(("True", self.block(depth + 1, max_depth, size)))
+        return node("If", filename=self.filename, linenumber=line, entries=entries)
+
+    def menu(self, depth, max_depth, size, choices=3):
+        # a menu with a caption is a say statement on the same line, that doesn't interact
+        line = self.line
+        caption = self.say(self.random.choice(CHARACTERS[1:]), interact=False)
+        items = []
+        for choice in range(choices):
+            self.next_line()
+            condition = "True" if choice else "points > 1"
+            items.append((f"Choice {choice}", condition, self.block(depth + 1, max_depth, size)))
+        menu = node("Menu", filename=self.filename, linenumber=line, items=items, set=None,
+                    with_=None, arguments=None, item_arguments=[None] * choices)
+        return [caption, menu]
+
+    def block(self, depth, max_depth, size, weights=(8, 1, 1, 1, 1, 1, 1)):
+        """
+        A block of size statements, mostly dialogue. Up to max_depth, blocks contain if and menu
+        statements with blocks of their own.
+        """
+        kinds = ("say", "python", "show", "scene", "jump", "if", "menu")
+        block = []
+        for kind in self.random.choices(kinds, weights, k=size):
+            if kind in ("if", "menu") and depth >= max_depth:
+                kind = "say"
+
+            if kind == "say":
+                block.append(self.say(self.random.choice(CHARACTERS)))
+            elif kind == "python":
+                block.append(self.python(f"points += {self.random.randint(1, 5)}"))
+            elif kind == "show":
+                block.append(self.show())
+            elif kind == "scene":
+                block.append(self.scene())
+                block.append(self.with_())
+            elif kind == "jump":
+                block.append(self.jump("ending"))
+                # nothing after a jump is reachable, so ren'py scripts rarely have it
+                break
+            elif kind == "if":
+                block.append(self.if_(depth, max_depth, size))
+            else:
+                block.extend(self.menu(depth, max_depth, size))
+        return block
+
+    def label(self, name, block):
+        line = self.next_line()
+        return node("Label", filename=self.filename, linenumber=line, name=name,
+                    block=block(), parameters=None, hide=False)
+
+    def init(self, priority, *statements):
+        return node("Init", filename=self.filename, linenumber=statements[0].linenumber,
+                    priority=priority, block=list(statements))
+
+    def define(self, name, source):
+        line = self.next_line()
+        define = node("Define", filename=self.filename, linenumber=line, varname=name,
+                      code=pycode(source, (self.filename, line), "eval"), store="store",
+                      index=None, operator="=")
+        return self.init(0, define)
+
+    # ATL
+
+    def atl_block(self, statements):
+        # the location of a block is that of the line introducing it
+        return node("RawBlock", "renpy.atl", loc=self.location(), animation=False,
+                    statements=statements())
+
+    def atl_parallel(self, *blocks):
+        blocks = [self.atl_block(statements) for statements in blocks]
+        return node("RawParallel", "renpy.atl", loc=blocks[0].loc, blocks=blocks)
+
+    def atl_choice(self, *choices):
+        choices = [(chance, self.atl_block(statements)) for chance, statements in choices]
+        return node("RawChoice", "renpy.atl", loc=choices[0][1].loc, choices=choices)
+
+    def atl_multipurpose(self, warper=None, duration="0", properties=()):
+        return node("RawMultipurpose", "renpy.atl", loc=self.location(), warper=warper,
+                    warp_function=None, duration=duration, revolution=None, circles="0",
+                    splines=[], properties=list(properties), expressions=[])
+
+    def atl_statements(self, depth=0):
+        statements = [
+            self.atl_multipurpose(properties=[("xalign", "0.5"), ("alpha", "0.0")]),
+            self.atl_multipurpose("ease", "1.0", [("alpha", "1.0"), ("yoffset", "-20")]),
+        ]
+        if depth < 2:
+            statements.append(self.atl_parallel(
+                lambda: [self.atl_multipurpose("linear", "2.0", [("xpos", "0.8")])],
+                lambda: self.atl_statements(depth + 1)))
+            statements.append(self.atl_choice(
+                ("1.0", lambda: [self.atl_multipurpose(duration="0.5")]),
+                ("2.0", lambda: [self.atl_multipurpose("ease", "0.5", [("zoom", "1.1")])])))
+        statements.append(node("RawRepeat", "renpy.atl", loc=self.location(), repeats=None))
+        return statements
+
+    def transform(self, name):
+        atl = self.atl_block(self.atl_statements)
+        transform = node("Transform", filename=self.filename, linenumber=atl.loc[1],
+                         varname=name, parameters=None, store="store", atl=atl)
+        return self.init(0, transform)
+
+    # screen language
+
+    def displayable(self, displayable, module, style, positional=(), keyword=(),
+                    children=list):
+        location = self.location()
+        return node("SLDisplayable", "renpy.sl2.slast", location=location,
+                    displayable=CLASS_FACTORY(displayable, module), style=style,
+                    positional=list(positional), keyword=list(keyword), children=children(),
+                    variable=None, atl_transform=None)
+
+    def keyword(self, name, source):
+        return (name, self.expr(source))
+
+    def sl_block(self, children):
+        location = self.location()
+        return node("SLBlock", "renpy.sl2.slast", location=location, keyword=[],
+                    children=children())
+
+    def screen_children(self, index):
+        text = self.displayable("Text", "renpy.text.text", "text", [f'"Screen {index}"'])
+        loop_line = self.next_line()
+        button = self.displayable("_textbutton", "renpy.ui", "button", ["item.name"],
+                                  [self.keyword("action", "Return(item)")])
+        loop = node("SLFor", "renpy.sl2.slast", location=(self.filename, loop_line),
+                    variable="item", expression="items", index_expression=None,
+                    children=[button])
+        if_line = self.line
+        condition = node("SLIf", "renpy.sl2.slast", location=(self.filename, if_line), entries=[
+            ("show_close", self.sl_block(lambda: [self.displayable(
+                "_textbutton", "renpy.ui", "button", ['"Close"'],
+                [self.keyword("action", "Hide()")])])),
+            (None, self.sl_block(lambda: [self.displayable("Null", "renpy.display.layout",
+                                                           "default")])),
+        ])
+        return [text, loop, condition]
+
+    def screen(self, index):
+        line = self.next_line()
+        children = lambda: [self.displayable(  # noqa: E731
+            "Window", "renpy.display.layout", "frame", (),
+            [self.keyword("xalign", "0.5"), self.keyword("padding", "(10, 10)")],
+            lambda: [self.displayable("MultiBox", "renpy.display.layout", "vbox", (),
+                                      [self.keyword("spacing", "10")],
+                                      lambda: self.screen_children(index))])]
+        screen = node("SLScreen", "renpy.sl2.slast", location=(self.filename, line),
+                      name=f"screen_{index}", parameters=None, keyword=[], tag=None,
+                      children=children())
+        statement = node("Screen", filename=self.filename, linenumber=line, screen=screen)
+        return self.init(-500, statement)
+
+    # translations
+
+    def translate(self, language, index):
+        line = self.next_line()
+        say = self.say(self.random.choice(CHARACTERS))
+        translate = node("Translate", filename=self.filename, linenumber=line,
+                         identifier=f"start_{index:08x}", language=language, block=[say],
+                         alternate=None)
+        end = node("EndTranslate", filename=self.filename, linenumber=line)
+        self.next_line()
+        return [translate, end]
+
+    def translate_string(self, language, index):
+        line = self.next_line()
+        new_line = self.next_line()
+        return node("TranslateString", filename=self.filename, linenumber=line,
+                    language=language, old=f"Choice {index}", new=f"Choix {index}",
+                    newloc=(self.filename, new_line))
+
+
+# Builders of the contents of each kind of file, given a ScriptBuilder and the scale
+
+def say_heavy(builder, scale):
+    statements = [builder.define("e", 'Character("Eileen")'),
+                  builder.define("mc", 'Character("Me")')]
+    for index in range(max(1, int(40 * scale))):
+        statements.append(builder.label(f"chapter_{index}", lambda: builder.block(
+            0, 0, 500, weights=(40, 1, 4, 2, 0, 0, 0))))
+    return statements
+
+
+def nested(builder, scale):
+    statements = [builder.define("points", "0")]
+    for index in range(max(1, int(6 * scale))):
+        statements.append(builder.label(f"route_{index}", lambda: builder.block(
+            0, 7, 4, weights=(3, 1, 0, 0, 0, 2, 2))))
+    return statements
+
+
+def mixed(builder, scale):
+    statements = [builder.define("points", "0"), builder.transform("appear"),
+                  builder.screen(0)]
+    for index in range(max(1, int(40 * scale))):
+        statements.append(builder.label(f"scene_{index}", lambda: builder.block(0, 2, 20)))
+    statements.append(builder.statement("Return", expression=None))
+    return statements
+
+
+def screens(builder, scale):
+    return [builder.screen(index) for index in range(max(1, int(400 * scale)))]
+
+
+def transforms(builder, scale):
+    return [builder.transform(f"move_{index}") for index in range(max(1, int(400 * scale)))]
+
+
+def translations(builder, scale):
+    statements = []
+    count = max(1, int(4000 * scale))
+    for index in range(count):
+        statements.extend(builder.translate("french", index))
+    # ren'py places the strings of a "translate strings" block in an init statement
+    strings = [builder.translate_string("french", index) for index in range(count // 10)]
+    statements.append(builder.init(0, *strings))
+    return statements
+
+
+# The layouts files are written in
+def layout_rpyc(data):
+    # ren'py 7 and 8: a header with a table of slots, slot 1 holding the zlib compressed pickle
+    blob = zlib.compress(data)
+    return (b"RENPY RPC2" + struct.pack("<III", 1, 46, len(blob))
+            + struct.pack("<III", 2, 46 + len(blob), 0) + struct.pack("<III", 0, 0, 0) + blob)
+
+
+def layout_legacy(data):
+    # ren'py 6: only the zlib compressed pickle
+    return zlib.compress(data)
+
+
+def layout_obfuscated(data):
+    # A changed magic and a base64 encoded slot, which --try-harder gets through
+    blob = base64.b64encode(zlib.compress(data))
+    return (OBFUSCATED_MAGIC + struct.pack("<III", 1, 46, len(blob))
+            + struct.pack("<III", 2, 46 + len(blob), 0) + struct.pack("<III", 0, 0, 0) + blob
+            + b"\0")
+
+
+# The files of the corpus as (path, contents, layout). Files that need --try-harder are placed
+# under obfuscated/, the rest under game/.
+CORPUS = (
+    ("game/say_heavy.rpyc", say_heavy, layout_rpyc),
+    ("game/nested.rpyc", nested, layout_rpyc),
+    ("game/mixed.rpyc", mixed, layout_rpyc),
+    ("game/screens.rpyc", screens, layout_rpyc),
+    ("game/transforms.rpyc", transforms, layout_rpyc),
+    ("game/tl/french/script.rpyc", translations, layout_rpyc),
+    ("game/legacy.rpyc", mixed, layout_legacy),
+    ("obfuscated/mixed.rpyc", mixed, layout_obfuscated),
+)
+
+
+def rpyc_bytes(statements, layout=layout_rpyc):
+    """Returns the contents of an rpyc file holding statements."""
+    buffer = io.BytesIO()
+    # ren'py always pickles with protocol 2
+    CorpusPickler(buffer, 2).dump(({"version": RENPY_VERSION, "key": "unlocked"},
+                                          statements))
+    return layout(buffer.getvalue())
+
+
+def generate(directory, scale=1.0, seed=0):
+    """
+    Writes the corpus to directory, and returns the paths of the files written. scale multiplies
+    the amount of statements in each file.
+    """
+    directory = Path(directory)
+    paths = []
+    for name, contents, layout in CORPUS:
+        # the source filename ren'py records in the ast
+        source = "game/" + name.split("/", 1)[1][:-1]
+        statements = contents(ScriptBuilder(source, seed), scale)
+
+        path = directory / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(rpyc_bytes(statements, layout))
+        paths.append(path)
+    return paths
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a synthetic rpyc corpus")
+    ap.add_argument('directory', help="The directory to write the corpus to.")
+    ap.add_argument('--scale', type=float, default=1.0,
+                    help="Multiplies the amount of statements in each file.")
+    ap.add_argument('--seed', type=int, default=0, help="Seed for the generated contents.")
+    args = ap.parse_args()
+
+    for path in generate(args.directory, args.scale, args.seed):
+        print(f"{path.stat().st_size:>10}  {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+# String encoder benchmark. Generates a large amount of dialogue with corpus.dialogue, and times
+# each of the encoders of decompiler/encoders.py over all of it. Reports the best time of a
+# number of runs of each.
+#
+# usage: python benchmarks/encoders.py [--runs 3] [--lines 200000] [--seed 0]
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks import corpus  # noqa: E402
+from decompiler.encoders import encode_say_string, repr_escape, string_escape  # noqa: E402
+
+ENCODERS = (
+    ("encode_say_string", encode_say_string),
+    ("string_escape", string_escape),
+    ("repr_escape", repr_escape),
+)
+
+
+def measure(encoder, lines, runs):
+    """Encodes all lines with encoder runs times, and returns the best time in seconds."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for line in lines:
+            encoder(line)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure the string encoders")
+    ap.add_argument('--runs', type=int, default=3,
+                    help="Amount of times to encode the lines. The best time is reported.")
+    ap.add_argument('--lines', type=int, default=200000,
+                    help="Amount of lines of dialogue to encode.")
+    ap.add_argument('--seed', type=int, default=0, help="Seed for the dialogue.")
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    lines = [corpus.dialogue(rng) for _ in range(args.lines)]
+    size = sum(len(line) for line in lines)
+
+    print(f"{args.lines} lines of dialogue, {size / 1e6:.1f} M characters, "
+          f"best of {args.runs} runs")
+    for name, encoder in ENCODERS:
+        print(f"{name:<24}{measure(encoder, lines, args.runs) * 1000:>10.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
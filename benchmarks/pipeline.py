@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# Pipeline benchmark. Generates the synthetic corpus of corpus.py, decompiles each of its files a
+# number of times while timing the stages unrpyc goes through (read, inflate, unpickle,
+# decompile, write, ...), and times unrpyc.main on the whole corpus. The medians are saved as
+# json, by default as benchmarks/results/<commit>.json, and can be compared with the results of
+# another commit. Exits with an error if --compare is given and something got slower than
+# --max-regression allows.
+#
+# usage: python benchmarks/pipeline.py [--runs 5] [--scale 1.0] [--corpus DIR]
+#                                      [--output FILE] [--compare FILE] [--max-regression 10]
+
+import argparse
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import unrpyc  # noqa: E402
+from benchmarks import corpus  # noqa: E402
+
+
+def commit_name():
+    """The commit the tree is at, marked as dirty when it has changes."""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def measure_file(path, try_harder, runs):
+    """
+    Decompiles the file at path runs times. Returns the median wall time in seconds of each
+    stage, and of the whole file as "total".
+    """
+    timings = {}
+    for _ in range(runs):
+        context = unrpyc.Context(path)
+        start = time.perf_counter()
+        unrpyc.decompile_rpyc(path, context, overwrite=True, try_harder=try_harder,
+                              init_offset=True)
+        total = time.perf_counter() - start
+        if context.state != "ok":
+            raise Exception(f"Decompiling {path} failed:\n" + "\n".join(context.log_contents))
+
+        for stage, (wall, _) in context.timings.items():
+            timings.setdefault(stage, []).append(wall)
+        timings.setdefault("total", []).append(total)
+
+    return {stage: statistics.median(values) for stage, values in timings.items()}
+
+
+def measure_main(arguments, runs):
+    """Runs unrpyc.main with arguments runs times, and returns the median wall time."""
+    argv = sys.argv
+    timings = []
+    try:
+        for _ in range(runs):
+            sys.argv = ["unrpyc.py", "--clobber", *arguments]
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                unrpyc.main()
+            timings.append(time.perf_counter() - start)
+    finally:
+        sys.argv = argv
+    return statistics.median(timings)
+
+
+def run(directory, runs):
+    files = {}
+    for name, _, layout in corpus.CORPUS:
+        try_harder = layout is corpus.layout_obfuscated
+        files[name] = measure_file(directory / name, try_harder, runs)
+
+    main = {
+        "game": measure_main([str(directory / "game")], runs),
+        "obfuscated --try-harder": measure_main(["--try-harder", str(directory / "obfuscated")],
+                                                runs),
+    }
+    return files, main
+
+
+def stage_columns(files):
+    present = set().union(*files.values())
+    return [stage for stage in unrpyc.STAGES if stage in present] + ["total"]
+
+
+def print_results(results):
+    columns = stage_columns(results["files"])
+    print(f"{'file (ms)':<28}" + "".join(f"{column:>12}" for column in columns))
+    for name, timings in results["files"].items():
+        print(f"{name:<28}" + "".join(
+            f"{timings[column] * 1000:>12.1f}" if column in timings else f"{'':>12}"
+            for column in columns))
+
+    print("")
+    for name, seconds in results["main"].items():
+        print(f"unrpyc.main {name:<30}{seconds * 1000:>11.1f} ms")
+
+
+def compare(before, after):
+    """
+    Prints how the timings in after changed compared to before. Returns the largest slowdown in
+    percent, of the stage totals over all files, the file totals, and the runs of main.
+    """
+    rows = []
+    columns = stage_columns(after["files"])
+    for column in columns:
+        names = [name for name, timings in after["files"].items()
+                 if column in timings and column in before["files"].get(name, {})]
+        if names:
+            rows.append((f"stage {column}",
+                         sum(before["files"][name][column] for name in names),
+                         sum(after["files"][name][column] for name in names)))
+    for name, timings in after["files"].items():
+        if name in before["files"]:
+            rows.append((name, before["files"][name]["total"], timings["total"]))
+    for name, seconds in after["main"].items():
+        if name in before["main"]:
+            rows.append((f"unrpyc.main {name}", before["main"][name], seconds))
+
+    print(f"{'compared to ' + before['commit']:<44}{'before ms':>11}{'after ms':>11}"
+          f"{'change':>9}")
+    worst = 0.0
+    for name, old, new in rows:
+        change = (new - old) / old * 100 if old else 0.0
+        worst = max(worst, change)
+        print(f"{name:<44}{old * 1000:>11.1f}{new * 1000:>11.1f}{change:>+8.1f}%")
+    return worst
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the stages of unrpyc on a synthetic "
+                                 "corpus")
+    ap.add_argument('--runs', type=int, default=5,
+                    help="Amount of times each file is decompiled. The median is reported.")
+    ap.add_argument('--scale', type=float, default=1.0,
+                    help="Multiplies the amount of statements in each file of the corpus.")
+    ap.add_argument('--seed', type=int, default=0, help="Seed for the corpus.")
+    ap.add_argument('--corpus', type=Path, default=None,
+                    help="Generate the corpus in this directory and keep it, instead of in a "
+                    "temporary directory.")
+    ap.add_argument('--output', type=Path, default=None,
+                    help="Where to save the results. Defaults to "
+                    "benchmarks/results/<commit>.json.")
+    ap.add_argument('--compare', type=Path, default=None,
+                    help="Results of an earlier run to compare with.")
+    ap.add_argument('--max-regression', type=float, default=None,
+                    help="With --compare, fail if anything is more than this many percent "
+                    "slower.")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        directory = args.corpus or Path(temporary)
+        corpus.generate(directory, args.scale, args.seed)
+        files, main = run(directory, args.runs)
+
+    results = {
+        "commit": commit_name(),
+        "python": platform.python_version(),
+        "runs": args.runs,
+        "scale": args.scale,
+        "seed": args.seed,
+        "files": files,
+        "main": main,
+    }
+    print_results(results)
+
+    output = args.output or ROOT / "benchmarks" / "results" / f"{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    print(f"\nSaved the results to {output}")
+
+    if args.compare is None:
+        return
+
+    before = json.loads(args.compare.read_text(encoding="utf-8"))
+    if (before["scale"], before["seed"]) != (args.scale, args.seed):
+        print("\nWarning: the corpus of the compared results had a different scale or seed.")
+    print("")
+    worst = compare(before, results)
+
+    if args.max_regression is not None and worst > args.max_regression:
+        print(f"\nFAIL: slowed down by more than {args.max_regression}%")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Startup benchmark. Imports unrpyc in fresh interpreters with `-X importtime`, and reports how
+# long that took, and which modules took the longest. It also checks that the modules that are
+# supposed to be imported lazily weren't imported. Exits with an error if they were, or if
+# importing took longer than --max-ms, so this can be used to catch startup regressions.
+#
+# usage: python benchmarks/startup.py [--runs 10] [--top 15] [--max-ms 150] [--root DIR]
+
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+# modules that `import unrpyc` should not import
+LAZY_MODULES = ("deobfuscate", "decompiler.astdump", "decompiler.translate",
+                "decompiler.testcasedecompiler", "decompiler.codegen",
+                "decompiler.screendecompiler", "psutil")
+
+PROBE = "import sys, unrpyc; print(' '.join(sorted(sys.modules)))"
+
+
+def measure(root):
+    """
+    Imports unrpyc once in a fresh interpreter. Returns the cumulative import time per module in
+    microseconds, and the set of modules that were loaded afterwards.
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=root,
+                             capture_output=True, text=True, check=True)
+
+    times = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+
+    return times, set(process.stdout.split())
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure the startup time of unrpyc")
+    ap.add_argument('--runs', type=int, default=10, help="Amount of interpreters to start.")
+    ap.add_argument('--top', type=int, default=15, help="Amount of slowest modules to list.")
+    ap.add_argument('--max-ms', type=float, default=None,
+                    help="Fail if the median import time is above this.")
+    ap.add_argument('--root', default=Path(__file__).resolve().parent.parent,
+                    help="The directory containing unrpyc.py.")
+    args = ap.parse_args()
+
+    runs = [measure(args.root) for _ in range(args.runs)]
+    totals = sorted(times["unrpyc"] for times, _ in runs)
+    median = statistics.median(totals) / 1000
+
+    print(f"import unrpyc: median {median:.1f} ms, "
+          f"min {totals[0] / 1000:.1f} ms, max {totals[-1] / 1000:.1f} ms "
+          f"over {args.runs} runs")
+
+    # the slowest modules, by their median cumulative time
+    names = set.intersection(*(set(times) for times, _ in runs))
+    medians = {name: statistics.median(times[name] for times, _ in runs) for name in names}
+    print("\nslowest modules (cumulative ms):")
+    for name in sorted(medians, key=medians.get, reverse=True)[:args.top]:
+        print(f"  {medians[name] / 1000:8.1f}  {name}")
+
+    failed = False
+    loaded = set.union(*(modules for _, modules in runs))
+    eager = [name for name in LAZY_MODULES if name in loaded]
+    if eager:
+        print(f"\nFAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"\nFAIL: median import time is above {args.max_ms} ms")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# isinstance benchmark. Loads a large synthetic AST from the corpus of corpus.py the way unrpyc
+# does, then times a traversal doing the kind of isinstance() checks the decompilers do against
+# the fake renpy.ast classes (see decompiler/magic.py), as well as decompiling the whole AST.
+# Reports the best time of a number of runs of each.
+#
+# usage: python benchmarks/traversal.py [--runs 5] [--scale 1.0] [--seed 0]
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import unrpyc  # noqa: E402
+from benchmarks import corpus  # noqa: E402
+from decompiler.renpycompat import renpy  # noqa: E402
+
+
+def collect_nodes(ast):
+    """Returns all statements in ast, including the ones in blocks, menus and if statements."""
+    nodes = []
+    pending = list(ast)
+    while pending:
+        node = pending.pop()
+        nodes.append(node)
+        pending.extend(getattr(node, "block", None) or ())
+        for entry in getattr(node, "entries", None) or getattr(node, "items", None) or ():
+            pending.extend(entry[-1] or ())
+    return nodes
+
+
+def check_nodes(nodes, classes):
+    """isinstance() checks every node against every class, and returns the amount of matches."""
+    matches = 0
+    for node in nodes:
+        for klass in classes:
+            if isinstance(node, klass):
+                matches += 1
+    return matches
+
+
+def best_of(runs, function, *arguments):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function(*arguments)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure isinstance() checks on the fake renpy "
+                                 "classes")
+    ap.add_argument('--runs', type=int, default=5,
+                    help="Amount of times to run each part. The best time is reported.")
+    ap.add_argument('--scale', type=float, default=1.0,
+                    help="Multiplies the amount of statements in the AST.")
+    ap.add_argument('--seed', type=int, default=0, help="Seed for the AST.")
+    args = ap.parse_args()
+
+    builder = corpus.ScriptBuilder("game/script.rpy", args.seed)
+    statements = corpus.nested(builder, args.scale) + corpus.mixed(builder, 5 * args.scale)
+    # unpickled like any rpyc file, so the classes are the ones the decompiler checks against
+    ast = unrpyc.load_ast(corpus.rpyc_bytes(statements))
+
+    classes = (renpy.ast.Say, renpy.ast.Label, renpy.ast.Init, renpy.ast.Menu,
+               renpy.ast.Python, renpy.ast.Show, renpy.ast.Scene, renpy.ast.Jump, renpy.ast.If)
+    nodes = collect_nodes(ast)
+    matches = check_nodes(nodes, classes)
+
+    traversal = best_of(args.runs, check_nodes, nodes, classes)
+    decompile = best_of(args.runs, unrpyc.decompile_ast, ast)
+
+    print(f"{len(nodes)} nodes, {len(classes)} checks per node, {matches} matches")
+    print(f"{'isinstance traversal':<24}{traversal * 1000:>10.1f} ms")
+    print(f"{'decompile':<24}{decompile * 1000:>10.1f} ms")
+    print(f"best of {args.runs} runs")
+
+
+if __name__ == '__main__':
+    main()
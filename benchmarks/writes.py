@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Write path micro-benchmark. Drives the output methods of DecompilerBase the way the decompilers
+# do when printing statements: an indent() starting each line followed by a couple of writes,
+# at changing indentation levels, into an in-memory file. Reports the best time of a number of
+# runs, so the cost of OutputBuffer and the write path can be compared between commits without
+# the rest of decompilation getting in the way.
+#
+# usage: python benchmarks/writes.py [--runs 5] [--lines 300000]
+
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from decompiler.util import DecompilerBase  # noqa: E402
+
+
+def write_lines(lines):
+    """
+    Writes lines lines through a DecompilerBase, the way a say statement is printed, and
+    returns the wall time in seconds and the length of the output.
+    """
+    out_file = io.StringIO()
+    decompiler = DecompilerBase(out_file)
+
+    start = time.perf_counter()
+    for i in range(lines):
+        # blocks of a few lines at a time, a few levels deep
+        decompiler.indent_level = (i >> 3) & 3
+        decompiler.indent()
+        decompiler.write("e")
+        decompiler.write(' "A line of dialogue, of about the usual length."')
+    decompiler.flush()
+    seconds = time.perf_counter() - start
+
+    return seconds, len(out_file.getvalue())
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure the write path of the decompilers")
+    ap.add_argument('--runs', type=int, default=5,
+                    help="Amount of times to write the lines. The best time is reported.")
+    ap.add_argument('--lines', type=int, default=300000, help="Amount of lines to write.")
+    args = ap.parse_args()
+
+    timings = []
+    for _ in range(args.runs):
+        seconds, length = write_lines(args.lines)
+        timings.append(seconds)
+
+    print(f"{args.lines} lines (indent + 2 writes), {length / 1e6:.1f} MB of output: "
+          f"best {min(timings) * 1000:.1f} ms, worst {max(timings) * 1000:.1f} ms "
+          f"over {args.runs} runs")
+
+
+if __name__ == '__main__':
+    main()
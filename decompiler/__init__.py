@@ -20,37 +20,181 @@
 
 from .util import DecompilerBase, First, WordConcatenator, reconstruct_paraminfo, \
                   reconstruct_arginfo, string_escape, split_logical_lines, Dispatcher, \
-                  say_get_code, OptionBase
+                  say_get_code, OptionBase, NodeStats
 from .renpycompat import renpy
 
+import multiprocessing
+from contextlib import nullcontext
 from operator import itemgetter
 from io import StringIO
+import importlib
 
 from . import sl2decompiler
-from . import testcasedecompiler
 from . import atldecompiler
-from . import astdump
 
 __all__ = ["astdump", "magic", "sl2decompiler", "testcasedecompiler", "translate", "util",
-           "Options", "pprint", "Decompiler", "renpycompat"]
+           "Options", "pprint", "Decompiler", "renpycompat", "NodeStats"]
+
+# Rarely used submodules, which are only imported when they're first used.
+LAZY_SUBMODULES = ("astdump", "testcasedecompiler", "translate")
+
+def __getattr__(name):
+    if name in LAZY_SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 # Main API
 
+def no_timer(stage):
+    return nullcontext()
+
 # Object that carries configurable decompilation options
 class Options(OptionBase):
     def __init__(self, indentation="    ", log=None,
                  translator=None, init_offset=False,
-                 sl_custom_names=None):
-        super(Options, self).__init__(indentation=indentation, log=log)
+                 sl_custom_names=None, processes=1, only=None, timer=no_timer, stats=None):
+        super(Options, self).__init__(indentation=indentation, log=log, stats=stats)
 
         # decompilation options
         self.translator = translator
         self.init_offset = init_offset
         self.sl_custom_names = sl_custom_names
+        # amount of processes used to decompile the top level statements of large files
+        self.processes = processes
+        # if given, a list of (kind, name) selectors. Only the top level statements containing
+        # the selected statements are decompiled. See select_nodes
+        self.only = only
+        # called with the name of a stage of decompilation, returns a context manager that is
+        # entered for the duration of that stage. Used to measure where time is spent.
+        self.timer = timer
 
 def pprint(out_file, ast, options=Options()):
     Decompiler(out_file, options).dump(ast)
 
+# Selective decompilation
+
+SELECTOR_KINDS = ("label", "screen", "transform", "image")
+
+
+def parse_selectors(spec):
+    """
+    Parses a string like "label:start,screen:main_menu" into a list of (kind, name) selectors.
+    Image names are their tags and attributes separated by spaces, like "image:eileen happy".
+    """
+    selectors = []
+    for item in spec.split(","):
+        kind, _, name = item.partition(":")
+        kind = kind.strip().lower()
+        name = " ".join(name.split())
+        if kind not in SELECTOR_KINDS or not name:
+            raise ValueError(
+                f'Bad selector "{item}", expected one of '
+                f'{", ".join(kind + ":name" for kind in SELECTOR_KINDS)}')
+        selectors.append((kind, name))
+    return selectors
+
+
+def node_selector(node):
+    """
+    Returns the (kind, name) selector that selects node, or None if it can't be selected.
+    """
+    if isinstance(node, renpy.ast.Label):
+        return ("label", node.name)
+    elif isinstance(node, renpy.ast.Screen):
+        return ("screen", node.screen.name)
+    elif isinstance(node, renpy.ast.Transform):
+        return ("transform", node.varname)
+    elif isinstance(node, renpy.ast.Image):
+        return ("image", " ".join(node.imgname))
+    return None
+
+
+def index_nodes(ast):
+    """
+    Builds an index of the selectable statements in the top level of ast, and directly inside
+    the init blocks there. Maps every (kind, name) selector to the indices of the top level
+    statements containing the statements it selects.
+    """
+    index = {}
+    for i, node in enumerate(ast):
+        children = node.block if isinstance(node, renpy.ast.Init) else (node,)
+        for child in children:
+            selector = node_selector(child)
+            if selector is not None:
+                index.setdefault(selector, []).append(i)
+    return index
+
+
+def select_nodes(ast, selectors):
+    """
+    Returns the sorted indices of the top level statements in ast that have to be decompiled to
+    show the statements selected by selectors. Labels that are printed as part of the call
+    before them take that call along, and labels with an empty block (menu labels, and labels
+    from old ren'py versions) take the statements up to the next label along.
+    """
+    index = index_nodes(ast)
+
+    selected = set()
+    for selector in selectors:
+        for i in index.get(selector, ()):
+            selected.add(i)
+            node = ast[i]
+            if not isinstance(node, renpy.ast.Label):
+                continue
+
+            if i and isinstance(ast[i - 1], renpy.ast.Call):
+                selected.add(i - 1)
+
+            if not node.block:
+                for j in range(i + 1, len(ast)):
+                    if isinstance(ast[j], renpy.ast.Label):
+                        break
+                    selected.add(j)
+
+    return sorted(selected)
+
+# Parallel decompilation of large files
+
+# Files with less lines than this are not worth splitting up.
+SPLIT_MIN_LINES = 5000
+# Amount of segments a file is split in, per process.
+SPLIT_SEGMENTS_PER_PROCESS = 4
+
+# The (ast, options, init_offset) of the file being split. Worker processes are forked after this
+# is set, so they inherit it instead of having to unpickle the ast again.
+SPLIT_JOB = None
+
+
+def decompile_segment(bounds):
+    """
+    Decompiles the top level nodes ast[start:end] of SPLIT_JOB, assuming the decompiler is in a
+    clean state right before ast[start] (see Decompiler.in_clean_state). Returns the text, the
+    linenumber and lines behind afterwards and the debug log, or None if the assumption can't be
+    made to hold or an error happened. The caller then has to decompile the segment itself.
+    """
+    ast, options, init_offset = SPLIT_JOB
+    start, end = bounds
+
+    options.log = []
+    out_file = StringIO()
+    decompiler = Decompiler(out_file, options)
+    decompiler.init_offset = init_offset
+    decompiler.linenumber = ast[start].linenumber - 1
+
+    try:
+        decompiler.print_segment(ast, start, end)
+    except Exception:
+        return None
+
+    if not decompiler.in_clean_state(init_offset):
+        return None
+
+    decompiler.flush()
+
+    return (out_file.getvalue(), decompiler.linenumber, decompiler.last_lines_behind,
+            options.log)
+
+
 # Implementation
 
 class Decompiler(DecompilerBase):
@@ -100,29 +244,175 @@ class Decompiler(DecompilerBase):
 
     def dump(self, ast):
         if self.options.translator:
-            self.options.translator.translate_dialogue(ast)
+            with getattr(self.options, "timer", no_timer)("translate"):
+                self.options.translator.translate_dialogue(ast)
 
         if self.options.init_offset and isinstance(ast, (tuple, list)):
             self.set_best_init_offset(ast)
 
-        # skip_indent_until_write avoids an initial blank line
-        super(Decompiler, self).dump(ast, skip_indent_until_write=True)
-        # if there's anything we wanted to write out but didn't yet, do it now
-        for m in self.blank_line_queue:
-            m(None)
-        self.write("\n# Decompiled by unrpyc: https://github.com/CensoredUsername/unrpyc\n")
+        try:
+            # skip_indent_until_write avoids an initial blank line
+            only = getattr(self.options, "only", None)
+            segments = None if only else self.split_segments(ast)
+            if only:
+                self.linenumber = 1
+                self.skip_indent_until_write = True
+                self.print_selected(ast, select_nodes(ast, only))
+            elif segments:
+                self.linenumber = 1
+                self.skip_indent_until_write = True
+                self.print_nodes_split(ast, segments)
+            else:
+                super(Decompiler, self).dump(ast, skip_indent_until_write=True)
+            # if there's anything we wanted to write out but didn't yet, do it now
+            for m in self.blank_line_queue:
+                m(None)
+            self.write("\n# Decompiled by unrpyc: https://github.com/CensoredUsername/unrpyc\n")
+        finally:
+            # also write out what we got so far if decompilation failed
+            self.flush()
         assert not self.missing_init, "A required init, init label, or translate block was missing"
 
-    def print_node(self, ast):
+    # Parallel decompilation. The output of the top level nodes of a file only depends on the
+    # state of the decompiler before them. Between most top level statements, that state is
+    # clean: nothing is pending, and we're on or before the line above the next statement. As
+    # the next statement then starts by advancing to its own line, its output is the same no
+    # matter where exactly we were. Segments starting at such statements can be decompiled in
+    # other processes in advance, and are used only if the state before them was indeed clean.
+
+    def in_clean_state(self, init_offset):
+        return (not self.blank_line_queue
+                and not self.skip_indent_until_write
+                and not self.indent_level
+                and not self.paired_with
+                and self.say_inside_menu is None
+                and self.label_inside_menu is None
+                and not self.in_init
+                and not self.missing_init
+                and self.init_offset == init_offset)
+
+    def split_segments(self, ast):
+        """
+        Returns the bounds of the segments the top level nodes in ast should be decompiled in, or
+        None if ast should not be split.
+        """
+        processes = getattr(self.options, "processes", 1)
+        if (processes < 2
+                or not isinstance(ast, list)
+                or len(ast) < 2
+                or multiprocessing.current_process().daemon
+                or "fork" not in multiprocessing.get_all_start_methods()):
+            return None
+
+        # segments can only start at statements that always advance to their own line first
+        starts = [i for i, node in enumerate(ast)
+                  if i and hasattr(node, "linenumber") and (
+                      isinstance(node, renpy.ast.Init)
+                      or (isinstance(node, renpy.ast.Label) and node.block
+                          and not isinstance(ast[i - 1], renpy.ast.Call)))]
+        if not starts:
+            return None
+
+        lines = ast[-1].linenumber - ast[0].linenumber if hasattr(ast[0], "linenumber") else 0
+        if lines < SPLIT_MIN_LINES:
+            return None
+
+        segment_lines = lines / (processes * SPLIT_SEGMENTS_PER_PROCESS)
+        bounds = [0]
+        for i in starts:
+            if ast[i].linenumber - ast[bounds[-1]].linenumber >= segment_lines:
+                bounds.append(i)
+        bounds.append(len(ast))
+
+        if len(bounds) < 3:
+            return None
+        return list(zip(bounds, bounds[1:]))
+
+    def print_selected(self, ast, indices):
+        # statements are placed at the line numbers recorded in the ast, where they can, which
+        # may be off from the lines they have when decompiling everything
+        start = end = None
+        for i in indices:
+            if i != end:
+                if start is not None:
+                    self.print_segment(ast, start, end)
+                start = i
+            end = i + 1
+        if start is not None:
+            self.print_segment(ast, start, end)
+
+    def print_segment(self, ast, start, end):
+        self.block_stack.append(ast)
+        self.index_stack.append(start)
+
+        for i in range(start, end):
+            self.index_stack[-1] = i
+            self.print_node(ast[i])
+
+        self.block_stack.pop()
+        self.index_stack.pop()
+
+    def print_nodes_split(self, ast, segments):
+        global SPLIT_JOB
+
+        # after any init offset statement was emitted, this is the offset that is in effect
+        init_offset = self.init_offset
+        for m in self.blank_line_queue:
+            init_offset = getattr(m, "init_offset", init_offset)
+
+        SPLIT_JOB = (ast, self.options, init_offset)
+        context = multiprocessing.get_context("fork")
+        try:
+            with context.Pool(self.options.processes - 1) as pool:
+                results = pool.imap(decompile_segment, segments[1:])
+
+                # the first segment is decompiled here while the workers handle the others
+                start, end = segments[0]
+                self.print_segment(ast, start, end)
+
+                remaining = iter(segments[1:])
+                for (start, end), result in zip(remaining, results):
+                    linenumber = ast[start].linenumber
+                    if self.linenumber >= linenumber:
+                        # The output is behind the line numbers of the ast, so the segments were
+                        # decompiled from the wrong line. This only gets worse further on, so
+                        # the rest of the file is decompiled here, without waiting for workers.
+                        pool.terminate()
+                        self.print_debug(
+                            f"Decompiling the rest of the file in one process, as the output "
+                            f"is past line {linenumber} where the next part starts.")
+                        self.print_segment(ast, start, end)
+                        for start, end in remaining:
+                            self.print_segment(ast, start, end)
+                        break
+
+                    if result is None or not self.in_clean_state(init_offset):
+                        self.print_segment(ast, start, end)
+                        continue
+
+                    text, end_linenumber, last_lines_behind, log = result
+                    self.write("\n" * (linenumber - self.linenumber - 1))
+                    self.write(text)
+                    self.linenumber = end_linenumber
+                    self.last_lines_behind = last_lines_behind
+                    self.most_lines_behind = max(self.most_lines_behind, last_lines_behind)
+                    self.options.log.extend(log)
+        finally:
+            SPLIT_JOB = None
+
+    def line_advance_policy(self, cls):
         # We special-case line advancement for some types in their print
         # methods, so don't advance lines for them here.
-        if hasattr(ast, 'linenumber') and not isinstance(
-                ast, (renpy.ast.TranslateString, renpy.ast.With, renpy.ast.Label,
-                      renpy.ast.Pass, renpy.ast.Return)
-                ):
+        return not issubclass(
+            cls, (renpy.ast.TranslateString, renpy.ast.With, renpy.ast.Label,
+                  renpy.ast.Pass, renpy.ast.Return))
+
+    def print_node(self, ast):
+        handler, advance = self.resolved.get(type(ast)) or self.resolve(type(ast))
+        if advance and hasattr(ast, 'linenumber'):
             self.advance_to_line(ast.linenumber)
 
-        self.dispatch.get(type(ast), type(self).print_unknown)(self, ast)
+        handler(self, ast)
 
     # ATL subdecompiler hook
 
@@ -335,10 +625,9 @@ class Decompiler(DecompilerBase):
         self.indent()
 
         # It's possible that we're an "init label", not a regular label. There's no way to know
-        # if we are until we parse our children, so temporarily redirect all of our output until
-        # that's done, so that we can squeeze in an "init " if we are.
-        out_file = self.out_file
-        self.out_file = StringIO()
+        # if we are until we parse our children, so reserve a spot in the output where we can
+        # squeeze in an "init " if we are.
+        init_mark = self.out_file.reserve()
         missing_init = self.missing_init
         self.missing_init = False
         try:
@@ -346,11 +635,8 @@ class Decompiler(DecompilerBase):
                        f'{" hide" if getattr(ast, "hide", False) else ""}:')
             self.print_nodes(ast.block, 1)
         finally:
-            if self.missing_init:
-                out_file.write("init ")
+            self.out_file.insert(init_mark, "init " if self.missing_init else "")
             self.missing_init = missing_init
-            out_file.write(self.out_file.getvalue())
-            self.out_file = out_file
 
     @dispatch(renpy.ast.Jump)
     def print_jump(self, ast):
@@ -478,6 +764,8 @@ class Decompiler(DecompilerBase):
                 self.init_offset = offset
             return False
 
+        # the offset this will set, for print_nodes_split
+        do_set_init_offset.init_offset = offset
         self.do_when_blank_line(do_set_init_offset)
 
     @dispatch(renpy.ast.Init)
@@ -875,6 +1163,7 @@ class Decompiler(DecompilerBase):
         self.require_init()
         self.indent()
         self.write(f'testcase {ast.label}:')
+        from . import testcasedecompiler
         self.linenumber = testcasedecompiler.pprint(
             self.out_file, ast.test.block, self.options,
             self.indent_level + 1, self.linenumber, self.skip_indent_until_write
@@ -22,6 +22,9 @@ import sys
 import inspect
 import renpy
 
+from .encoders import repr_escape
+from .util import OutputBuffer
+
 def pprint(out_file, ast, comparable=False, no_pyexpr=False):
     # The main function of this module, a wrapper which sets
     # the config and creates the AstDumper instance
@@ -39,7 +42,8 @@ class AstDumper(object):
     def __init__(self, out_file=None, no_pyexpr=False,
                  comparable=False, indentation="    "):
         self.indentation = indentation
-        self.out_file = out_file or sys.stdout
+        # written to in large chunks, see OutputBuffer
+        self.out_file = OutputBuffer(out_file or sys.stdout)
         self.comparable = comparable
         self.no_pyexpr = no_pyexpr
 
@@ -51,6 +55,7 @@ class AstDumper(object):
         self.passed = []
         self.passed_where = []
         self.print_ast(ast)
+        self.out_file.flush()
 
     def print_ast(self, ast):
         # Decides which function should be used to print the given ast object.
@@ -281,14 +286,7 @@ class AstDumper(object):
 
     def escape_string(self, string):
         # essentially the representation of a string without the surrounding quotes
-        if isinstance(string, str):
-            return repr(string)[1:-1]
-        elif isinstance(string, bytes):
-            return repr(string)[2:-1]
-        elif isinstance(string, bytearray):
-            return repr(bytes(string))[2:-1]
-        else:
-            return string
+        return repr_escape(string)
 
     def print_other(self, ast):
         # used as a last fallback
@@ -305,5 +303,10 @@ class AstDumper(object):
     def p(self, string):
         # write the string to the stream
         string = str(string)
-        self.linenumber += string.count('\n')
-        self.out_file.write(string)
+        lines = string.count('\n')
+        self.linenumber += lines
+        # output is only written out at the start of a line
+        if lines:
+            self.out_file.newline(string)
+        else:
+            self.out_file.write(string)
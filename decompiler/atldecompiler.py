@@ -45,19 +45,26 @@ class ATLDecompiler(DecompilerBase):
         self.skip_indent_until_write = skip_indent_until_write
 
         self.print_block(ast)
+        self.flush()
 
         return self.linenumber
 
+    def line_advance_policy(self, cls):
+        # whether this is a block, which we advance to differently
+        return issubclass(cls, renpy.atl.RawBlock)
+
     def print_node(self, ast):
+        handler, is_block = self.resolved.get(type(ast)) or self.resolve(type(ast))
+
         # Line advancement logic:
         if hasattr(ast, "loc"):
-            if isinstance(ast, renpy.atl.RawBlock):
+            if is_block:
                 self.advance_to_block(ast)
 
             else:
                 self.advance_to_line(ast.loc[1])
 
-        self.dispatch.get(type(ast), type(self).print_unknown)(self, ast)
+        handler(self, ast)
 
     def print_block(self, block):
         # Prints a block of ATL statements
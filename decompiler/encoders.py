@@ -0,0 +1,69 @@
+# Copyright (c) 2014-2024 CensoredUsername, Jackmcbarn
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# String encoders shared by the decompilers and the ast dumper. Dialogue makes up the bulk of most
+# games, and nearly all of it doesn't need escaping at all, so every encoder first checks for the
+# few characters it has to handle, and returns the string as is when there are none. The actual
+# escaping is done with chained str.replace calls, backslashes first. str.translate would do it in
+# one pass, but is several times slower on strings with non-ASCII characters, which dialogue has.
+
+import re
+
+
+# a space after a space would be collapsed by ren'py, unless escaped
+SAY_STRING_SPACES_RE = re.compile(r'(?<= ) ')
+
+def encode_say_string(s):
+    """
+    Encodes a string in the format used by Ren'Py say statements.
+    """
+
+    if "\\" in s or "\n" in s or "\"" in s:
+        s = s.replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+    if "  " in s:
+        s = SAY_STRING_SPACES_RE.sub(r'\\ ', s)
+
+    return "\"" + s + "\""
+
+
+def string_escape(s):  # TODO see if this needs to work like encode_say_string elsewhere
+    if "\\" in s or "\"" in s or "\n" in s or "\t" in s:
+        s = (s.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+             .replace("\t", "\\t"))
+    return s
+
+
+def repr_escape(string):
+    """
+    Returns the representation of a str, bytes or bytearray without the surrounding quotes (and
+    prefix). Anything else is returned as is.
+    """
+    if isinstance(string, str):
+        # repr wouldn't change these, except for adding the quotes
+        if string.isascii() and string.isprintable() and "'" not in string and "\\" not in string:
+            return string
+        return repr(string)[1:-1]
+    elif isinstance(string, bytes):
+        return repr(string)[2:-1]
+    elif isinstance(string, bytearray):
+        return repr(bytes(string))[2:-1]
+    else:
+        return string
@@ -99,10 +99,16 @@ class FakeClassType(type):
 
     def __init__(self, name, bases, attributes, module=None):
         type.__init__(self, name, bases, attributes)
+        # Cached results of the comparison logic below. These are stored on the class itself,
+        # as every class needs its own.
+        type.__setattr__(self, "_fake_hash", hash(self.__module__ + "." + self.__name__))
+        type.__setattr__(self, "_fake_subclasses", {})
 
     # comparison logic
 
     def __eq__(self, other):
+        if self is other:
+            return True
         if not hasattr(other, "__name__"):
             return False
         if hasattr(other, "__module__"):
@@ -114,15 +120,26 @@ class FakeClassType(type):
         return not self == other
 
     def __hash__(self):
-        return hash(self.__module__ + "." + self.__name__)
+        return self._fake_hash
 
     def __instancecheck__(self, instance):
         return self.__subclasscheck__(instance.__class__)
 
     def __subclasscheck__(self, subclass):
-        return (self == subclass or
-                (bool(subclass.__bases__) and
-                 any(self.__subclasscheck__(base) for base in subclass.__bases__)))
+        return _cached_subclasscheck(self, self._fake_subclasses, subclass)
+
+def _cached_subclasscheck(self, cache, subclass):
+    # The class hierarchy doesn't change, so the answer for each subclass is only worked out once.
+    # The cache is keyed by id, so a class that compares equal to another doesn't get its answer.
+    cached = cache.get(id(subclass))
+    if cached is not None and cached[0] is subclass:
+        return cached[1]
+
+    result = (self == subclass or
+              (bool(subclass.__bases__) and
+               any(self.__subclasscheck__(base) for base in subclass.__bases__)))
+    cache[id(subclass)] = (subclass, result)
+    return result
 
 # PY2 doesn't like the PY3 way of metaclasses and PY3 doesn't support the PY2 way
 # so we call the metaclass directly
@@ -306,6 +323,8 @@ class FakeModule(types.ModuleType):
     def __init__(self, name):
         super(FakeModule, self).__init__(name)
         sys.modules[name] = self
+        # cached results of issubclass() and isinstance(), see FakeClassType
+        self.__dict__["_fake_subclasses"] = {}
 
         if "." in name:
             parent_name, child_name = name.rsplit(".", 1)
@@ -367,9 +386,7 @@ class FakeModule(types.ModuleType):
         return self.__subclasscheck__(instance.__class__)
 
     def __subclasscheck__(self, subclass):
-        return (self == subclass or
-                (bool(subclass.__bases__) and
-                 any(self.__subclasscheck__(base) for base in subclass.__bases__)))
+        return _cached_subclasscheck(self, self._fake_subclasses, subclass)
 
 class FakePackage(FakeModule):
     """
@@ -527,6 +544,12 @@ class SafeUnpickler(FakeUnpickler):
     It should be noted though that when the unpickler tries to get a nonexistent
     attribute of a safe module, an :exc:`AttributeError` will be raised.
 
+    Fake classes whose module is a :class:`FakeModule` that already exists are bound to it, like
+    :class:`FakeUnpickler` does. Code referring to them through the module after unpickling
+    then gets the class the unpickled objects are instances of, so that ``isinstance()`` can take
+    the fast path of the exact type matching, instead of going through the comparison logic of
+    :class:`FakeModule`. Nothing is ever imported for this.
+
     This inherits from :class:`FakeUnpickler`
     """
     def __init__(self, file, class_factory=None, safe_modules=(),
@@ -544,7 +567,18 @@ class SafeUnpickler(FakeUnpickler):
                 klass = getattr(mod, name)
                 return klass
 
-        return self.class_factory(name, module)
+        klass = self.class_factory(name, module)
+
+        # don't let a class shadow a fake module that has submodules of its own
+        mod = sys.modules.get(module, None)
+        if isinstance(mod, FakeModule):
+            current = mod.__dict__.get(name, None)
+            if current is None or (
+                    isinstance(current, FakeModule) and not
+                    any(isinstance(i, FakeModule) for i in current.__dict__.values())):
+                setattr(mod, name, klass)
+
+        return klass
 
     def get_extension(self, code):
         if self.use_copyreg:
@@ -572,7 +606,7 @@ class SafePickler(pickle.Pickler if PY2 else pickle._Pickler):
                 self.write(pickle.STACK_GLOBAL)
             else:
                 self.write(pickle.GLOBAL
-                           + (obj.__module__ + '\n' + obj.__name__ + '\n').decode("utf-8"))
+                           + (obj.__module__ + '\n' + obj.__name__ + '\n').encode("utf-8"))
             self.memoize(obj)
             return
 
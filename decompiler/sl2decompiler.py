@@ -52,8 +52,9 @@ class SL2Decompiler(DecompilerBase):
     dispatch = Dispatcher()
 
     def print_node(self, ast):
+        handler, _ = self.resolved.get(type(ast)) or self.resolve(type(ast))
         self.advance_to_line(ast.location[1])
-        self.dispatch.get(type(ast), type(self).print_unknown)(self, ast)
+        handler(self, ast)
 
     @dispatch(sl2.slast.SLScreen)
     def print_screen(self, ast):
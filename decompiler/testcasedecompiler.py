@@ -40,9 +40,10 @@ class TestcaseDecompiler(DecompilerBase):
     dispatch = Dispatcher()
 
     def print_node(self, ast):
+        handler, _ = self.resolved.get(type(ast)) or self.resolve(type(ast))
         if hasattr(ast, 'linenumber'):
             self.advance_to_line(ast.linenumber)
-        self.dispatch.get(type(ast), type(self).print_unknown)(self, ast)
+        handler(self, ast)
 
     @dispatch(testast.Python)
     def print_python(self, ast):
@@ -21,24 +21,226 @@
 
 import sys
 import re
-from io import StringIO
+import time
 from contextlib import contextmanager
+from functools import lru_cache
+
+from .encoders import encode_say_string, string_escape  # noqa
 
 
 class OptionBase:
-    def __init__(self, indentation="    ", log=None):
+    def __init__(self, indentation="    ", log=None, stats=None):
         self.indentation = indentation
         self.log = [] if log is None else log
+        # a NodeStats to count and time the printed nodes in, if any
+        self.stats = stats
+
+
+class NodeStats:
+    """
+    Counts and times the nodes printed by the decompilers, per AST class and per handler method,
+    to find out which statements decompilation spends its time on. The time of a node is kept
+    both including and excluding the nodes inside it. It also counts how often each handler
+    saved and rolled back the decompiler state, which happens when a way of printing something
+    is tried out and has to be undone, as print_menu does for say statements inside menus.
+
+    Enabled by passing it as the stats option. Decompilers then print nodes through instrumented
+    handlers, so there is no cost when it isn't used.
+    """
+
+    def __init__(self):
+        # {name: [count, total time, own time]}
+        self.classes = {}
+        self.handlers = {}
+        # {handler name: [states saved, states rolled back]}
+        self.states = {}
+        # the handlers that are running, innermost last, as [name, time spent in nested nodes]
+        self.running = []
+        # the instrumented handlers of each dispatcher, as its resolved mapping
+        self.resolved = {}
+
+    def resolved_for(self, dispatcher):
+        return self.resolved.setdefault(id(dispatcher), {})
+
+    def instrument(self, cls, handler):
+        """Returns handler, wrapped to count and time the nodes of type cls it prints."""
+        class_entry = self.classes.setdefault(f'{cls.__module__}.{cls.__name__}', [0, 0.0, 0.0])
+        handler_name = getattr(handler, '__qualname__', repr(handler))
+        handler_entry = self.handlers.setdefault(handler_name, [0, 0.0, 0.0])
+        running = self.running
+        perf_counter = time.perf_counter
+
+        def instrumented(decompiler, ast):
+            frame = [handler_name, 0.0]
+            running.append(frame)
+            start = perf_counter()
+            try:
+                handler(decompiler, ast)
+            finally:
+                elapsed = perf_counter() - start
+                running.pop()
+                if running:
+                    running[-1][1] += elapsed
+                for entry in (class_entry, handler_entry):
+                    entry[0] += 1
+                    entry[1] += elapsed
+                    entry[2] += elapsed - frame[1]
+
+        return instrumented
+
+    def state_saved(self):
+        self.states.setdefault(self.current_handler(), [0, 0])[0] += 1
+
+    def state_rolled_back(self):
+        self.states.setdefault(self.current_handler(), [0, 0])[1] += 1
+
+    def current_handler(self):
+        return self.running[-1][0] if self.running else None
+
+    def merge(self, other):
+        """Adds the counts and times of another NodeStats to these."""
+        for mine, theirs in ((self.classes, other.classes), (self.handlers, other.handlers),
+                             (self.states, other.states)):
+            for name, values in theirs.items():
+                entry = mine.setdefault(name, [0] * len(values))
+                for i, value in enumerate(values):
+                    entry[i] += value
+
+    def __getstate__(self):
+        # the instrumented handlers can't be pickled, and are only of use in this process
+        state = self.__dict__.copy()
+        state["running"] = []
+        state["resolved"] = {}
+        return state
+
+    def summary(self, limit=20):
+        """
+        Returns lines of text ranking the most expensive AST classes and handlers by their own
+        time, at most limit of each, and the state saves and rollbacks per handler.
+        """
+        lines = []
+        for title, entries in (("AST class", self.classes), ("Handler", self.handlers)):
+            ranked = sorted(entries.items(), key=lambda item: item[1][2], reverse=True)
+            if not ranked:
+                continue
+            lines.append(f"{title:<44}{'count':>9}{'total s':>10}{'own s':>9}{'own us':>9}")
+            for name, (count, total, own) in ranked[:limit]:
+                lines.append(f"{name[-44:]:<44}{count:>9}{total:>10.3f}{own:>9.3f}"
+                             f"{own / count * 1e6 if count else 0:>9.1f}")
+            lines.append("")
+
+        if self.states:
+            lines.append(f"{'Saved states':<44}{'saved':>9}{'rolled back':>12}")
+            for name, (saved, rolled_back) in sorted(self.states.items(),
+                                                     key=lambda item: item[1][0], reverse=True):
+                lines.append(f"{str(name)[-44:]:<44}{saved:>9}{rolled_back:>12}")
+        elif lines:
+            lines.pop()
+        return lines
+
+
+class OutputBuffer:
+    """
+    The stream decompilers write to. Written strings are collected as a list of parts, and only
+    joined and written to out_file in large chunks, at the start of a new line once enough of
+    them have accumulated, and when `flush` is called at the end of the output.
+
+    It also supports going back to earlier points in the output:
+
+    - `checkpoint` returns a mark, to which the output can be reverted with `rollback`, or which
+      can be released with `commit` to keep everything written since.
+    - `reserve` returns a mark at which a string can be inserted later with `insert`.
+
+    Nothing is written to out_file while marks are open, so all of these operations are O(1)
+    (rollback amortized). Marks have to be released in the reverse order they were taken in.
+    """
+
+    # amount of parts after which they are written to out_file
+    chunk_parts = 4096
+
+    def __init__(self, out_file):
+        self.out_file = out_file
+        self.parts = []
+        self.marks = 0
+        # writes don't need to check anything, so they can go straight to the list
+        self.write = self.parts.append
+
+    def newline(self, string):
+        """
+        Writes `string`, which starts a new line. Flushes if enough output has accumulated.
+        """
+        parts = self.parts
+        parts.append(string)
+        if len(parts) >= self.chunk_parts and not self.marks:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes everything collected so far to out_file. Must only be called when no marks are
+        open, or when they are abandoned.
+        """
+        self.out_file.write("".join(self.parts))
+        self.parts.clear()
+
+    def checkpoint(self):
+        self.marks += 1
+        return len(self.parts)
+
+    def commit(self, mark):
+        self.marks -= 1
+
+    def rollback(self, mark):
+        del self.parts[mark:]
+        self.marks -= 1
+
+    def reserve(self):
+        self.marks += 1
+        self.parts.append("")
+        return len(self.parts) - 1
+
+    def insert(self, mark, string):
+        self.parts[mark] = string
+        self.marks -= 1
+
+
+class IndentCache(dict):
+    """
+    Maps indentation levels to the string starting a new line at that level.
+    """
+
+    def __init__(self, indentation):
+        super().__init__()
+        self.indentation = indentation
+
+    def __missing__(self, level):
+        string = self[level] = '\n' + self.indentation * level
+        return string
 
 
 class DecompilerBase:
     def __init__(self, out_file=None, options=OptionBase()):
-        # the file object that the decompiler outputs to
-        self.out_file = out_file or sys.stdout
+        # the buffer that the decompiler outputs to. Decompilers invoked from other decompilers
+        # get passed the buffer of their parent, which they share.
+        out_file = out_file or sys.stdout
+        # only the decompiler that created the buffer flushes it
+        self.owns_output = not isinstance(out_file, OutputBuffer)
+        self.out_file = OutputBuffer(out_file) if self.owns_output else out_file
         # Decompilation options
         self.options = options
         # the string we use for indentation
         self.indentation = options.indentation
+        # the strings starting a new line at each indentation level
+        self.indent_strings = IndentCache(self.indentation)
+        # the node types print_node knows how to print, see resolve. Subclasses that print
+        # nodes have a dispatch
+        self.stats = getattr(options, "stats", None)
+        dispatch = getattr(self, "dispatch", None)
+        if dispatch is None:
+            self.resolved = {}
+        elif self.stats is None:
+            self.resolved = dispatch.resolved
+        else:
+            self.resolved = self.stats.resolved_for(dispatch)
 
 
         # properties used for keeping track of where we are
@@ -68,8 +270,17 @@ class DecompilerBase:
         if not isinstance(ast, (tuple, list)):
             ast = [ast]
         self.print_nodes(ast)
+        self.flush()
         return self.linenumber
 
+    def flush(self):
+        """
+        Writes any buffered output to the file given in the constructor, unless that buffer is
+        shared with the decompiler that invoked us, in which case that one will do it.
+        """
+        if self.owns_output:
+            self.out_file.flush()
+
     @contextmanager
     def increase_indent(self, amount=1):
         self.indent_level += amount
@@ -82,7 +293,8 @@ class DecompilerBase:
         """
         Shorthand method for writing `string` to the file
         """
-        string = str(string)
+        if string.__class__ is not str:
+            string = str(string)
         self.linenumber += string.count('\n')
         self.skip_indent_until_write = False
         self.out_file.write(string)
@@ -102,29 +314,31 @@ class DecompilerBase:
         """
         Save our current state.
         """
-        state = (self.out_file,
+        if self.stats is not None:
+            self.stats.state_saved()
+        state = (self.out_file.checkpoint(),
                  self.skip_indent_until_write,
                  self.linenumber,
                  self.block_stack,
                  self.index_stack,
                  self.indent_level,
                  self.blank_line_queue)
-        self.out_file = StringIO()
         return state
 
     def commit_state(self, state):
         """
         Commit changes since a saved state.
         """
-        out_file = state[0]
-        out_file.write(self.out_file.getvalue())
-        self.out_file = out_file
+        self.out_file.commit(state[0])
 
     def rollback_state(self, state):
         """
         Roll back to a saved state.
         """
-        (self.out_file,
+        if self.stats is not None:
+            self.stats.state_rolled_back()
+        self.out_file.rollback(state[0])
+        (_,
          self.skip_indent_until_write,
          self.linenumber,
          self.block_stack,
@@ -140,7 +354,9 @@ class DecompilerBase:
             # Stop one line short, since the call to indent() will advance the last line.
             # Note that if self.linenumber == linenumber - 1, this will write the empty string.
             # This is to make sure that skip_indent_until_write is cleared in that case.
-            self.write("\n" * (linenumber - self.linenumber - 1))
+            self.out_file.write("\n" * (linenumber - self.linenumber - 1))
+            self.linenumber = linenumber - 1
+            self.skip_indent_until_write = False
 
     def do_when_blank_line(self, m):
         """
@@ -157,7 +373,8 @@ class DecompilerBase:
         calls the write method
         """
         if not self.skip_indent_until_write:
-            self.write('\n' + self.indentation * self.indent_level)
+            self.linenumber += 1
+            self.out_file.newline(self.indent_strings[self.indent_level])
 
     def print_nodes(self, ast, extra_indent=0):
         # This node is a list of nodes
@@ -202,6 +419,27 @@ class DecompilerBase:
     def print_node(self, ast):
         raise NotImplementedError()
 
+    def resolve(self, cls):
+        """
+        Returns the method that prints nodes of type `cls`, and how print_node should advance
+        lines before calling it, as given by line_advance_policy. Matching the fake classes is
+        slow, so this is only worked out once per type, after which print_node can find both
+        with a single lookup in self.resolved. When collecting NodeStats, the method is
+        instrumented, and these are kept separately from the uninstrumented ones.
+        """
+        handler = self.dispatch.get(cls, type(self).print_unknown)
+        if self.stats is not None:
+            handler = self.stats.instrument(cls, handler)
+        entry = self.resolved[cls] = (handler, self.line_advance_policy(cls))
+        return entry
+
+    def line_advance_policy(self, cls):
+        """
+        Returns how print_node should advance lines for nodes of type `cls`. What this means is
+        up to the decompiler.
+        """
+        return None
+
 class First:
     # An often used pattern is that on the first item
     # of a loop something special has to be done. This class
@@ -392,13 +630,6 @@ def reconstruct_arginfo(arginfo):
 
     return "".join(rv)
 
-def string_escape(s):  # TODO see if this needs to work like encode_say_string elsewhere
-    s = s.replace('\\', '\\\\')
-    s = s.replace('"', '\\"')
-    s = s.replace('\n', '\\n')
-    s = s.replace('\t', '\\t')
-    return s
-
 # keywords used by ren'py's parser
 KEYWORDS = set(['$', 'as', 'at', 'behind', 'call', 'expression', 'hide',
                 'if', 'in', 'image', 'init', 'jump', 'menu', 'onlayer',
@@ -407,6 +638,31 @@ KEYWORDS = set(['$', 'as', 'at', 'behind', 'call', 'expression', 'hide',
 
 word_regexp = '[a-zA-Z_\u00a0-\ufffd][0-9a-zA-Z_\u00a0-\ufffd]*'
 
+# The patterns used by the Lexer, compiled only once.
+WHITESPACE_RE = re.compile(r"(\s+|\\\n)+", re.DOTALL)
+# parse strings the ren'py way (don't parse docstrings, no b/r in front allowed)
+# edit: now parses docstrings correctly. There was a degenerate case where
+# '''string'string''' would result in issues
+STRING_REGEXP = r"""(u?(?P<a>"(?:"")?|'(?:'')?).*?(?<=[^\\])(?:\\\\)*(?P=a))"""
+STRING_RE = re.compile(STRING_REGEXP, re.DOTALL)
+NUMBER_RE = re.compile(r'(\+|\-)?(\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?', re.DOTALL)
+DOT_RE = re.compile(r'\.', re.DOTALL)
+# The tokens split_logical_lines cares about: a newline, an opening bracket or a closing
+# bracket (as groups 1 to 3), or a comment, a string, or anything up to the next of those.
+LOGICAL_LINE_TOKEN_RE = re.compile(
+    r"""(\n)|([(\[{])|([)\]}])|#[^\n]*|""" + STRING_REGEXP + r"""|[^\n()\[\]{}#"']+|.""",
+    re.DOTALL)
+
+@lru_cache(maxsize=None)
+def word_re():
+    # compiling this takes long due to the big character ranges, so it's done on first use
+    return re.compile(word_regexp, re.DOTALL)
+
+# The same expressions and code turn up over and over again in a game, so the results of
+# lexing them are remembered for this many different strings.
+LEXER_CACHE_SIZE = 4096
+
+@lru_cache(maxsize=LEXER_CACHE_SIZE)
 def simple_expression_guard(s):
     # Some things we deal with are supposed to be parsed by
     # ren'py's Lexer.simple_expression but actually cannot
@@ -422,7 +678,12 @@ def simple_expression_guard(s):
         return f'({s})'
 
 def split_logical_lines(s):
-    return Lexer(s).split_logical_lines()
+    # callers get their own list, as the cached result is shared
+    return list(_split_logical_lines(s))
+
+@lru_cache(maxsize=LEXER_CACHE_SIZE)
+def _split_logical_lines(s):
+    return tuple(Lexer(s).split_logical_lines())
 
 class Lexer:
     # special lexer for simple_expressions the ren'py way
@@ -432,13 +693,13 @@ class Lexer:
         self.length = len(string)
         self.string = string
 
-    def re(self, regexp):
-        # see if regexp matches at self.string[self.pos].
+    def re(self, pattern):
+        # see if the compiled pattern matches at self.string[self.pos].
         # if it does, increment self.pos
         if self.length == self.pos:
             return None
 
-        match = re.compile(regexp, re.DOTALL).match(self.string, self.pos)
+        match = pattern.match(self.string, self.pos)
         if not match:
             return None
 
@@ -447,22 +708,19 @@ class Lexer:
 
     def eol(self):
         # eat the next whitespace and check for the end of this simple_expression
-        self.re(r"(\s+|\\\n)+")
+        self.re(WHITESPACE_RE)
         return self.pos >= self.length
 
-    def match(self, regexp):
-        # strip whitespace and match regexp
-        self.re(r"(\s+|\\\n)+")
-        return self.re(regexp)
+    def match(self, pattern):
+        # strip whitespace and match pattern
+        self.re(WHITESPACE_RE)
+        return self.re(pattern)
 
     def python_string(self, clear_whitespace=True):
-        # parse strings the ren'py way (don't parse docstrings, no b/r in front allowed)
-        # edit: now parses docstrings correctly. There was a degenerate case where
-        # '''string'string''' would result in issues
         if clear_whitespace:
-            return self.match(r"""(u?(?P<a>"(?:"")?|'(?:'')?).*?(?<=[^\\])(?:\\\\)*(?P=a))""")
+            return self.match(STRING_RE)
         else:
-            return self.re(r"""(u?(?P<a>"(?:"")?|'(?:'')?).*?(?<=[^\\])(?:\\\\)*(?P=a))""")
+            return self.re(STRING_RE)
 
 
     def container(self):
@@ -492,11 +750,11 @@ class Lexer:
 
     def number(self):
         # parses a number, float or int (but not forced long)
-        return self.match(r'(\+|\-)?(\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+        return self.match(NUMBER_RE)
 
     def word(self):
         # parses a word
-        return self.match(word_regexp)
+        return self.match(word_re())
 
     def name(self):
         # parses a word unless it's in KEYWORDS.
@@ -524,7 +782,7 @@ class Lexer:
         while not self.eol():
 
             # if the previous was followed by a dot, there should be a word after it
-            if self.match(r'\.'):
+            if self.match(DOT_RE):
                 if not self.name():
                     # ren'py errors here. I just stop caring
                     return False
@@ -548,41 +806,29 @@ class Lexer:
 
         contained = 0
 
+        string = self.string
         startpos = self.pos
 
-        while self.pos < self.length:
-            c = self.string[self.pos]
+        # every character is part of some token, so this goes through the string in one pass
+        for match in LOGICAL_LINE_TOKEN_RE.finditer(string, self.pos):
+            kind = match.lastindex
 
-            if (c == '\n'
-                    and not contained
-                    and (not self.pos or self.string[self.pos - 1] != '\\')):
-                lines.append(self.string[startpos:self.pos])
-                # the '\n' is not included in the emitted line
-                self.pos += 1
-                startpos = self.pos
-                continue
+            if kind == 1:
+                pos = match.start()
+                if not contained and (not pos or string[pos - 1] != '\\'):
+                    lines.append(string[startpos:pos])
+                    # the '\n' is not included in the emitted line
+                    startpos = pos + 1
 
-            if c in ('(', '[', '{'):
+            elif kind == 2:
                 contained += 1
-                self.pos += 1
-                continue
 
-            if c in (')', ']', '}') and contained:
+            elif kind == 3 and contained:
                 contained -= 1
-                self.pos += 1
-                continue
-
-            if c == '#':
-                self.re("[^\n]*")
-                continue
-
-            if self.python_string(False):
-                continue
-
-            self.re(r'\w+| +|.')  # consume a word, whitespace or one symbol
 
+        self.pos = self.length
         if self.pos != startpos:
-            lines.append(self.string[startpos:])
+            lines.append(string[startpos:])
         return lines
 
 # Versions of Ren'Py prior to 6.17 put trailing whitespace on the end of
@@ -614,25 +860,17 @@ class WordConcatenator(object):
 
 # Dict subclass for aesthetic dispatching. use @Dispatcher(data) to dispatch
 class Dispatcher(dict):
+    def __init__(self):
+        super().__init__()
+        # concrete node type -> (handler, line advancement policy). See DecompilerBase.resolve
+        self.resolved = {}
+
     def __call__(self, name):
         def closure(func):
             self[name] = func
             return func
         return closure
 
-# ren'py string handling
-def encode_say_string(s):
-    """
-    Encodes a string in the format used by Ren'Py say statements.
-    """
-
-    s = s.replace("\\", "\\\\")
-    s = s.replace("\n", "\\n")
-    s = s.replace("\"", "\\\"")
-    s = re.sub(r'(?<= ) ', '\\ ', s)
-
-    return "\"" + s + "\""
-
 # Adapted from Ren'Py's Say.get_code
 def say_get_code(ast, inmenu=False):
     rv = []
@@ -31,11 +31,19 @@
 # Then, there's 0 or more steps of decrypting the data in that slot. This ends up often
 # being layers of base64, string-escape, hex-encoding, zlib-compression, etc.
 # We handle this by just trying these by checking if they fit.
+#
+# Trying every extractor is slow for large files, so known schemes can also be registered as
+# profiles. A profile is an extractor that declares a cheap fingerprint of the files it handles.
+# Profiles are matched before the generic strategies are tried, and the first one that works
+# wins. Profiles can also be loaded from a directory of python files (see load_profiles).
 
 import base64
+import importlib.util
+import math
 import struct
 import zlib
 from collections import Counter
+from pathlib import Path
 
 from decompiler.renpycompat import pickle_safe_loads
 
@@ -54,11 +62,131 @@ def decryptor(f):
     return f
 
 
-# Add game-specific custom extraction / decryption logic here
+# Profiles are extractors of (fobj, slotno) -> bytes with a fingerprint. They also raise
+# ValueError if they fail. The fingerprint consists of up to three parts, all of which must match:
+#   magic:   the bytes the file starts with.
+#   header:  a tuple of (struct format, predicate). The format is unpacked from the bytes right
+#            after the magic, and the predicate is called with the unpacked values.
+#   entropy: a (low, high) band of the shannon entropy of the file head, in bits per byte.
+# Profiles with magic bytes are indexed on them, so picking candidates is a dict lookup per
+# distinct magic length instead of a trial of every strategy.
+PROFILES = {}
+UNKEYED_PROFILES = []
+PROFILE_HEAD_SIZE = 4096
+def profile(magic=None, header=None, entropy=None):
+    def closure(f):
+        f.fingerprint = (magic, header, entropy)
+        if magic is None:
+            UNKEYED_PROFILES.append(f)
+        else:
+            PROFILES.setdefault(magic, []).append(f)
+        return f
+    return closure
+
+
+def head_entropy(head):
+    """
+    Shannon entropy of the given bytes, in bits per byte.
+    """
+    if not head:
+        return 0.0
+    total = len(head)
+    return -sum(n / total * math.log2(n / total) for n in Counter(head).values())
+
+
+def match_profiles(f):
+    """
+    Returns the profiles whose fingerprint matches the file object f, most specific first.
+    """
+    f.seek(0)
+    head = f.read(PROFILE_HEAD_SIZE)
+    f.seek(0)
+
+    candidates = []
+    for length in sorted({len(magic) for magic in PROFILES}, reverse=True):
+        candidates.extend(PROFILES.get(head[:length], ()))
+    candidates.extend(UNKEYED_PROFILES)
+
+    entropy = None
+    matches = []
+    for candidate in candidates:
+        magic, header, band = candidate.fingerprint
+
+        if header is not None:
+            fmt, predicate = header
+            start = len(magic) if magic else 0
+            if len(head) < start + struct.calcsize(fmt):
+                continue
+            if not predicate(*struct.unpack_from(fmt, head, start)):
+                continue
+
+        if band is not None:
+            if entropy is None:
+                entropy = head_entropy(head)
+            low, high = band
+            if not low <= entropy <= high:
+                continue
+
+        matches.append(candidate)
+
+    return matches
+
+
+LOADED_PROFILE_FILES = set()
+def load_profiles(directory):
+    """
+    Imports every python file in directory. These files can register extra profiles (or
+    extractors and decryptors) by importing this module and using its decorators. Files that
+    were already loaded are skipped, so this is safe to call once per worker. A file that fails
+    to load raises its error, and is tried again on the next call.
+    """
+    for path in sorted(Path(directory).glob("*.py")):
+        path = path.resolve()
+        if path in LOADED_PROFILE_FILES:
+            continue
+
+        spec = importlib.util.spec_from_file_location(f'deobfuscate_profile_{path.stem}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        LOADED_PROFILE_FILES.add(path)
+
+
+# Add game-specific custom extraction / decryption logic here, or put it in a profile file
+# and load it with --profiles. A profile file looks like this:
+#
+#   import deobfuscate
+#
+#   @deobfuscate.profile(magic=b"MYGAME RPC", entropy=(7.5, 8.0))
+#   def extract_slot_mygame(f, slot):
+#       ...
 
 # End of custom extraction/decryption logic
 
 
+@profile(magic=b'RENPY RPC2',
+         header=("<IIIIIIIII",
+                 lambda a, b, c, d, e, f, g, h, i: (a == 1 and b == 46 and d == 2 and b + c == e
+                                                    and (g, h, i) == (0, 0, 0))))
+def extract_slot_rpyc_default(f, slot):
+    """
+    Profile for files with the exact header layout ren'py generates, so their slot can be read
+    directly.
+    """
+    if slot != 1:
+        raise ValueError("Default layout profile only supports slot 1")
+
+    f.seek(10)
+    _, start, length = struct.unpack("<III", f.read(12))
+    f.seek(start)
+    data = f.read(length)
+    f.seek(0)
+
+    if len(data) != length:
+        raise ValueError("Header data is incompatible with file length")
+
+    return data
+
+
 @extractor
 def extract_slot_rpyc(f, slot):
     """
@@ -279,6 +407,18 @@ def assert_is_normal_rpyc(f):
 def read_ast(f, context):
     diagnosis = ["Attempting to deobfuscate file:"]
 
+    for candidate in match_profiles(f):
+        try:
+            raw_data = candidate(f, 1)
+            data, stmts, d = try_decrypt_section(raw_data)
+        except ValueError as e:
+            diagnosis.append(f'profile {candidate.__name__} failed: {chr(10).join(e.args)}')
+        else:
+            diagnosis.append(f'profile {candidate.__name__} success')
+            diagnosis.extend(d)
+            context.log("\n".join(diagnosis))
+            return stmts
+
     raw_datas = set()
 
     for extractor in EXTRACTORS:
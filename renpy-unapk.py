@@ -1,4 +1,8 @@
+import os
 import sys
+import time
+import json
+import hashlib
 import zipfile
 import shutil
 import argparse
@@ -6,7 +10,7 @@ import logging
 import traceback
 
 try:
-    from multiprocessing import Pool, cpu_count
+    from multiprocessing import cpu_count
 except ImportError:
     # Mock required support when multiprocessing is unavailable
     def cpu_count():
@@ -15,24 +19,12 @@ except ImportError:
 from pathlib import Path
 import unrpyc
 
-class Context:
-    def __init__(self):
-        self.log_contents = []
-        self.error = None
-        self.state = "error"
-        self.value = None
-
-    def log(self, message):
-        self.log_contents.append(message)
-
-    def set_error(self, error):
-        self.error = error
-
-    def set_result(self, value):
-        self.value = value
-
-    def set_state(self, state):
-        self.state = state
+class Context(unrpyc.Context):
+    """
+    The result of decompiling a single file. It has every field of unrpyc's Context, so the
+    report, summaries and schedulers shared with unrpyc can handle it.
+    """
+    pass
 
 
 def worker_common(arg_tup):
@@ -46,20 +38,26 @@ def worker_common(arg_tup):
         Context: Decompilation result context
     """
     args, filename = arg_tup
-    context = Context()
+    context = Context(filename)
 
+    started = time.perf_counter()
     try:
+        if args.profiles:
+            import deobfuscate
+            deobfuscate.load_profiles(args.profiles)
+
         # Use the original unrpyc decompilation method with default arguments
         unrpyc.decompile_rpyc(
             filename, context,
-            overwrite=getattr(args, 'clobber', False),
-            try_harder=getattr(args, 'try_harder', False)
-            dump=getattr(args, 'dump', False),
-            no_pyexpr=getattr(args, 'no_pyexpr', False),
-            comparable=getattr(args, 'comparable', False),
-            init_offset=getattr(args, 'init_offset', True),
-            sl_custom_names=getattr(args, 'sl_custom_names', None),
-            translator=getattr(args, 'translator', None)
+            overwrite=args.clobber,
+            try_harder=args.try_harder,
+            dump=args.dump,
+            no_pyexpr=args.no_pyexpr,
+            comparable=args.comparable,
+            init_offset=args.init_offset,
+            sl_custom_names=args.sl_custom_names,
+            translator=args.translator,
+            cache=unrpyc.DecompilationCache(args.cache_dir) if args.cache_dir else None
         )
 
     except Exception as e:
@@ -67,40 +65,158 @@ def worker_common(arg_tup):
         context.log(f'Error while decompiling {filename}:')
         context.log(traceback.format_exc())
 
+    context.duration = time.perf_counter() - started
     return context
 
 
-def run_workers(worker, common_args, private_args, parallelism):
+# Bump this when the fingerprints or the way entries are stored change, so older entries are no
+# longer used.
+INDEX_FORMAT = 3
+
+
+def apk_fingerprint(apk_path):
+    """
+    Fingerprint an APK from the names, sizes and CRC32s of the files in its zip central
+    directory. These are all the output depends on, so an APK that was only signed again gets the
+    same fingerprint. Nothing is inflated, so only the central directory is read.
+
+    Args:
+        apk_path (Path): Path to the APK file
+
+    Returns:
+        str: Hex digest identifying the APK contents
+    """
+    digest = hashlib.sha256()
+
+    with zipfile.ZipFile(apk_path) as zf:
+        for info in zf.infolist():
+            digest.update(f'{info.filename}\0{info.CRC:08x}\0{info.file_size}\0'.encode())
+
+    return digest.hexdigest()
+
+
+def link_tree(source, destination):
+    """
+    Recreate the directory tree at source at destination, hard-linking the files. Files that
+    cannot be linked, for example because they are on another file system, are copied.
+
+    Args:
+        source (Path): Existing directory tree
+        destination (Path): Directory to create
+    """
+    def link_or_copy(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    shutil.copytree(source, destination, copy_function=link_or_copy)
+
+
+def merge_tree(source, destination, replace=False):
+    """
+    Move the files of the directory tree at source into the existing tree at destination. Files
+    that already exist at destination are kept, unless replace is set.
+
+    Args:
+        source (Path): Directory tree to move the files of
+        destination (Path): Existing directory to move them into
+        replace (bool): Whether to replace files that exist at destination
+
+    Returns:
+        int: The amount of files that were kept
+    """
+    kept = 0
+    # sorted, so directories come before their contents
+    for path in sorted(source.rglob('*')):
+        target = destination / path.relative_to(source)
+        if path.is_dir():
+            target.mkdir(exist_ok=True)
+        elif target.exists() and not replace:
+            kept += 1
+        else:
+            os.replace(path, target)
+    return kept
+
+
+class ResultIndex:
+    """
+    Maps APK fingerprints to the output trees they were processed into, stored as a json file.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+
+        try:
+            with self.path.open('r', encoding='utf-8') as index_file:
+                contents = json.load(index_file)
+        except (OSError, ValueError):
+            return
+        if isinstance(contents, dict) and contents.get('format') == INDEX_FORMAT:
+            self.entries = contents.get('apks', {})
+
+    def lookup(self, fingerprint, options):
+        """
+        Find the output tree of an APK with this fingerprint, processed with these options.
+
+        Args:
+            fingerprint (str): Fingerprint from apk_fingerprint
+            options (dict): The options affecting the output, see RenPyUnapk.output_options
+
+        Returns:
+            Path or None: The output tree, if it still exists
+        """
+        entry = self.entries.get(fingerprint)
+        if entry is None or entry.get('options') != options:
+            return None
+
+        output = Path(entry['output'])
+        return output if output.is_dir() else None
+
+    def record(self, fingerprint, apk_path, output, options):
+        """
+        Record the output tree an APK was processed into, and save the index.
+
+        Args:
+            fingerprint (str): Fingerprint from apk_fingerprint
+            apk_path (Path): Path to the APK file
+            output (Path): The finished output tree
+            options (dict): The options affecting the output, see RenPyUnapk.output_options
+        """
+        self.entries[fingerprint] = {'apk': str(apk_path.resolve()),
+                                     'output': str(output.resolve()),
+                                     'options': options}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with unrpyc.atomic_open(self.path) as index_file:
+            json.dump({'format': INDEX_FORMAT, 'apks': self.entries}, index_file, indent=1)
+
+
+def run_workers(worker, common_args, private_args, parallelism, journal=None):
     """
     Runs worker in parallel using multiprocessing.
 
     Args:
         worker (callable): Worker function to execute
-        common_args (argparse.Namespace): Common arguments
+        common_args (argparse.Namespace): Common arguments, including the worker limits
         private_args (list): List of files to process
         parallelism (int): Number of processes to use
+        journal (unrpyc.Journal): Journal to record every result in, if any
 
     Returns:
         list: Results from workers
     """
-    worker_args = ((common_args, x) for x in private_args)
-
-    results = []
-    if parallelism > 1:
-        with Pool(parallelism) as pool:
-            for result in pool.imap(worker, worker_args, 1):
-                results.append(result)
-                for line in result.log_contents:
-                    print(line)
-                print("")
-    else:
-        for result in map(worker, worker_args):
-            results.append(result)
-            for line in result.log_contents:
-                print(line)
-            print("")
-
-    return results
+    # Shares the implementation with unrpyc, including the time and memory limits
+    memory_budget = common_args.memory_budget
+    return unrpyc.run_workers(
+        worker, common_args, private_args, parallelism,
+        soft_timeout=common_args.soft_timeout,
+        hard_timeout=common_args.hard_timeout,
+        max_tasks=common_args.max_tasks,
+        memory_budget=None if memory_budget is None else memory_budget * 1024 * 1024,
+        journal=journal
+    )
 
 
 class RenPyUnapk:
@@ -108,6 +224,13 @@ class RenPyUnapk:
         """Initialize the RenPy Unapk tool with configuration."""
         self.logger = self._setup_logging()
         self.args = self._prepare_args(args)
+        self.index = ResultIndex(self.args.index) if self.args.index else None
+        self.journal = (unrpyc.Journal(self.args.journal, self.args.resume)
+                        if self.args.journal else None)
+        self.report = (unrpyc.Report(self.args.report, "RenPy-UnApk",
+                                     try_harder=self.args.try_harder)
+                       if self.args.report else None)
+        self.file_records = []
 
     def _setup_logging(self):
         """Configure logging for the application."""
@@ -128,16 +251,14 @@ class RenPyUnapk:
         Returns:
             argparse.Namespace: Prepared arguments with default values
         """
-        # Start with a base Namespace with default values
-        prepared_args = argparse.Namespace(
-            clobber=False,
-            try_harder=False,
-            dump=False,
-            no_pyexpr=False,
-            comparable=False,
-            init_offset=True,
-            sl_custom_names=None,
-            translator=None
+        # Start from the defaults of unrpyc, plus the options of this tool
+        prepared_args = unrpyc.default_args(
+            index=None,
+            duplicates='skip',
+            journal=None,
+            resume=False,
+            report=None,
+            verbose=False
         )
 
         # Update with provided args if any
@@ -176,21 +297,34 @@ class RenPyUnapk:
         """
         self.logger.info(f"Extracting {apk_path}")
 
-        # Create extraction directories
+        # Create extraction directories. The output is assembled in the temporary folder, so an
+        # interrupted extraction never leaves a partial game folder behind.
         game_folder = apk_path.with_suffix('')
         temp_folder = Path.cwd() / "TMP_APK_EXTRACT"
-        game_folder.mkdir(exist_ok=True)
-        temp_folder.mkdir(exist_ok=True)
+        staging_folder = temp_folder / "output"
+        if temp_folder.exists():
+            shutil.rmtree(temp_folder)
+        staging_folder.mkdir(parents=True)
 
         # Extract APK contents
+        started = time.perf_counter()
         with zipfile.ZipFile(apk_path) as zf:
             zf.extractall(temp_folder)
+            members = zf.infolist()
+        duration = time.perf_counter() - started
+
+        if self.report is not None:
+            extracted = sum(info.file_size for info in members)
+            self.report.write(type="apk", path=str(apk_path), size=apk_path.stat().st_size,
+                              members=len(members), extracted_size=extracted,
+                              duration=duration,
+                              throughput=extracted / (1024 * 1024) / duration if duration else None)
 
         # Move required files
         try:
             shutil.move(
                 temp_folder / 'assets' / 'x-game',
-                game_folder
+                staging_folder
             )
 
             # Move icons and splash screen
@@ -203,7 +337,19 @@ class RenPyUnapk:
             for src, dest in icon_sources:
                 src_path = temp_folder / src
                 if src_path.exists():
-                    shutil.move(src_path, game_folder / dest)
+                    shutil.move(src_path, staging_folder / dest)
+
+            # Remove 'x-' prefix from files and directories
+            self.remove_prefix_from_names(staging_folder, 'x-')
+
+            if not game_folder.exists():
+                shutil.move(staging_folder, game_folder)
+            else:
+                # Extracting over an earlier extraction, or a run interrupted before the journal
+                # recorded this one. Existing files are only replaced with --clobber.
+                kept = merge_tree(staging_folder, game_folder, self.args.clobber)
+                if kept:
+                    self.logger.info(f"Kept {kept} existing files in {game_folder}")
 
         except Exception as e:
             self.logger.error(f"Error moving files: {e}")
@@ -212,39 +358,59 @@ class RenPyUnapk:
         # Clean up temporary folder
         shutil.rmtree(temp_folder)
 
-        # Remove 'x-' prefix from files and directories
-        self.remove_prefix_from_names(game_folder, 'x-')
-
         self.logger.info(f"Extracted to {game_folder}")
         return game_folder
 
-    def decompile_rpyc(self, game_folder: Path):
+    def decompile_rpyc(self, *game_folders: Path):
         """
-        Decompile RenPy scripts in the game folder.
+        Decompile RenPy scripts in the game folders.
+
+        The scripts of all folders are decompiled as a single batch, with the most expensive
+        files started first, so that one big script does not run alone at the end.
 
         Args:
-            game_folder (Path): Folder containing game files
+            game_folders (Path): Folders containing game files
+
+        Returns:
+            list: The contexts of all decompiled files
         """
-        self.logger.info(f"Decompiling RenPy scripts in {game_folder}")
+        rpyc_files = []
+        for game_folder in game_folders:
+            self.logger.info(f"Decompiling RenPy scripts in {game_folder}")
 
-        # Find all .rpyc and .rpymc files
-        rpyc_files = list(game_folder.rglob('*.rpyc')) + list(game_folder.rglob('*.rpymc'))
+            # Find all .rpyc and .rpymc files
+            rpyc_files.extend(game_folder.rglob('*.rpyc'))
+            rpyc_files.extend(game_folder.rglob('*.rpymc'))
 
         if not rpyc_files:
             self.logger.warning("No script files found to decompile.")
-            return
+            return []
+
+        if self.journal is not None:
+            finished = self.journal.finished_files()
+            remaining = [f for f in rpyc_files if str(f.resolve()) not in finished]
+            if len(remaining) < len(rpyc_files):
+                self.logger.info(f"Already decompiled before resuming: "
+                                 f"{len(rpyc_files) - len(remaining)}")
+            rpyc_files = remaining
+            if not rpyc_files:
+                return []
+
+        unrpyc.sort_by_cost(rpyc_files, self.args.try_harder)
 
         # Use multiprocessing to match the original implementation
         parallelism = min(max(1, cpu_count() - 1), len(rpyc_files))
 
         # Run workers similar to the original implementation
-        results = run_workers(worker_common, self.args, rpyc_files, parallelism)
+        results = run_workers(worker_common, self.args, rpyc_files, parallelism, self.journal)
 
         # Log results
         success = sum(result.state == "ok" for result in results)
         skipped = sum(result.state == "skip" for result in results)
         failed = sum(result.state == "error" for result in results)
         broken = sum(result.state == "bad_header" for result in results)
+        timed_out = sum(result.state == "timeout" for result in results)
+        cache_hits = sum(result.cache == "hit" for result in results)
 
         self.logger.info(f"Decompilation summary:")
         self.logger.info(f"Total files: {len(results)}")
@@ -252,6 +418,144 @@ class RenPyUnapk:
         self.logger.info(f"Skipped: {skipped}")
         self.logger.info(f"Failed: {failed}")
         self.logger.info(f"Bad headers: {broken}")
+        self.logger.info(f"Timed out: {timed_out}")
+
+        if self.args.cache_dir:
+            cache = unrpyc.DecompilationCache(self.args.cache_dir)
+            evicted = cache.evict(self.args.cache_size * 1024 * 1024)
+            self.logger.info(f"Taken from the cache: {cache_hits}")
+            self.logger.info(f"Removed from the cache: {evicted}")
+
+        if self.args.report or self.args.verbose:
+            for line in unrpyc.timing_summary(results):
+                self.logger.info(line)
+
+        if self.report is not None:
+            self.file_records.extend(self.report.file_record(result) for result in results)
+
+        return results
+
+    def close(self):
+        """Finish the report of the run, if one is written."""
+        if self.report is not None:
+            self.report.close(self.file_records)
+            self.report = None
+
+    def find_previous_result(self, apk_path: Path):
+        """
+        Look up an APK in the result index.
+
+        Args:
+            apk_path (Path): Path to the APK file
+
+        Returns:
+            tuple: The fingerprint of the APK, or None without an index, and the output tree it
+                was processed into before, or None
+        """
+        if self.index is None:
+            return None, None
+
+        fingerprint = apk_fingerprint(apk_path)
+        return fingerprint, self.index.lookup(fingerprint, self.output_options())
+
+    def output_options(self):
+        """
+        The options that change the output of an APK. Its earlier output is only reused when
+        these are the same.
+
+        Returns:
+            dict: The options, as stored in the result index
+        """
+        profiles = self.args.profiles
+        return {'try_harder': self.args.try_harder,
+                'profiles': str(Path(profiles).resolve()) if profiles else None,
+                'init_offset': self.args.init_offset}
+
+    def reuse_result(self, apk_path: Path, previous: Path):
+        """
+        Handle an APK that was processed before, by skipping it or by hard-linking the previous
+        output tree to its game folder, as configured with --duplicates.
+
+        Args:
+            apk_path (Path): Path to the APK file
+            previous (Path): Output tree of the identical APK
+        """
+        game_folder = apk_path.with_suffix('')
+
+        if self.args.duplicates == 'link' and not game_folder.exists():
+            link_tree(previous, game_folder)
+            self.logger.info(f"{apk_path} was processed before, linked {previous} to {game_folder}")
+        else:
+            self.logger.info(f"{apk_path} was processed before into {previous}, skipping")
+
+    def record_result(self, fingerprint, apk_path: Path, game_folder: Path, results) -> bool:
+        """
+        Add a processed APK to the result index, if all its scripts were decompiled.
+
+        Returns:
+            bool: Whether all its scripts were decompiled
+        """
+        # skipped scripts or ones with a bad header may decompile with other options
+        if any(result.state != "ok" for result in results):
+            if fingerprint is not None:
+                self.logger.warning(f"Not adding {apk_path} to the result index, as some of its "
+                                    "scripts were not decompiled")
+            return False
+
+        if fingerprint is not None:
+            self.index.record(fingerprint, apk_path, game_folder, self.output_options())
+        return True
+
+    def journal_stage(self, apk_path: Path):
+        """
+        Find how far an APK got in the run recorded in the journal.
+
+        Args:
+            apk_path (Path): Path to the APK file
+
+        Returns:
+            dict or None: The last journal entry about the APK
+        """
+        if self.journal is None:
+            return None
+
+        apk = str(apk_path.resolve())
+        entries = [entry for entry in self.journal.entries if entry.get('apk') == apk]
+        return entries[-1] if entries else None
+
+    def finished_before(self, apk_path: Path) -> bool:
+        """Check if the journal records that an APK was processed completely."""
+        stage = self.journal_stage(apk_path)
+        if stage is not None and stage['stage'] == 'done':
+            self.logger.info(f"{apk_path} was processed before the run was resumed, skipping")
+            return True
+        return False
+
+    def extract_or_resume(self, apk_path: Path) -> Path:
+        """
+        Extract an APK, unless the journal records that it was extracted already.
+
+        Args:
+            apk_path (Path): Path to the APK file
+
+        Returns:
+            Path: Extracted game directory
+        """
+        stage = self.journal_stage(apk_path)
+        if stage is not None and stage['stage'] == 'extracted' and Path(stage['output']).is_dir():
+            self.logger.info(f"{apk_path} was extracted before the run was resumed")
+            return Path(stage['output'])
+
+        game_folder = self.extract_apk(apk_path)
+        if self.journal is not None:
+            self.journal.write(apk=str(apk_path.resolve()), stage='extracted',
+                               output=str(game_folder.resolve()))
+        return game_folder
+
+    def mark_done(self, apk_path: Path):
+        """Record in the journal that an APK was processed completely."""
+        if self.journal is not None:
+            self.journal.write(apk=str(apk_path.resolve()), stage='done')
 
     def process_apk(self, apk_path: Path):
         """
@@ -261,12 +565,87 @@ class RenPyUnapk:
             apk_path (Path): Path to the APK file
         """
         try:
-            game_folder = self.extract_apk(apk_path)
-            self.decompile_rpyc(game_folder)
+            if self.finished_before(apk_path):
+                return
+
+            fingerprint, previous = self.find_previous_result(apk_path)
+            if previous is not None:
+                self.reuse_result(apk_path, previous)
+                self.mark_done(apk_path)
+                return
+
+            game_folder = self.extract_or_resume(apk_path)
+            results = self.decompile_rpyc(game_folder)
+            self.record_result(fingerprint, apk_path, game_folder, results)
+            self.mark_done(apk_path)
             self.logger.info(f"Successfully processed {apk_path}")
         except Exception as e:
             self.logger.error(f"Failed to process {apk_path}: {e}")
 
+    def process_apks(self, apk_paths):
+        """
+        Processing method for multiple APK files. All APKs are extracted first, so their scripts
+        can be decompiled together in a single batch.
+
+        Args:
+            apk_paths (list): Paths to the APK files
+        """
+        extracted = []
+        # APKs identical to another one in this batch, handled once that one is done
+        duplicates = []
+        fingerprints = {}
+        for apk_path in apk_paths:
+            try:
+                if self.finished_before(apk_path):
+                    continue
+
+                fingerprint, previous = self.find_previous_result(apk_path)
+                if previous is not None:
+                    self.reuse_result(apk_path, previous)
+                    self.mark_done(apk_path)
+                elif fingerprint in fingerprints:
+                    duplicates.append((apk_path, fingerprints[fingerprint]))
+                else:
+                    game_folder = self.extract_or_resume(apk_path)
+                    extracted.append((apk_path, fingerprint, game_folder))
+                    if fingerprint is not None:
+                        fingerprints[fingerprint] = game_folder
+            except Exception as e:
+                self.logger.error(f"Failed to process {apk_path}: {e}")
+
+        if not extracted:
+            return
+
+        # game folders whose scripts were all decompiled, which duplicates can reuse
+        successful = set()
+        try:
+            results = self.decompile_rpyc(*(game_folder for _, _, game_folder in extracted))
+        except Exception as e:
+            for apk_path, _, _ in extracted:
+                self.logger.error(f"Failed to process {apk_path}: {e}")
+        else:
+            for apk_path, fingerprint, game_folder in extracted:
+                if self.record_result(fingerprint, apk_path, game_folder,
+                                      [result for result in results
+                                       if game_folder in Path(result.filename or '').parents]):
+                    successful.add(game_folder)
+                self.mark_done(apk_path)
+                self.logger.info(f"Successfully processed {apk_path}")
+
+        for apk_path, game_folder in duplicates:
+            if game_folder not in successful:
+                self.logger.warning(f"Processing {apk_path} on its own, as not all scripts of "
+                                    f"the identical APK extracted to {game_folder} were "
+                                    "decompiled")
+                self.process_apk(apk_path)
+                continue
+
+            try:
+                self.reuse_result(apk_path, game_folder)
+                self.mark_done(apk_path)
+            except Exception as e:
+                self.logger.error(f"Failed to process {apk_path}: {e}")
+
 
 def parse_arguments():
     """Parse command-line arguments for the tool."""
@@ -277,15 +656,60 @@ def parse_arguments():
     parser.add_argument('-l', '--language', default='english',
                         help='Language for translation file (default: english)')
 
-    parser.add_argument('-t', '--translation-file'
+    parser.add_argument('-t', '--translation-file',
                         help='File to use for translations during decompilation')
 
     parser.add_argument('--try-harder', action='store_true',
                         help='Attempt advanced deobfuscation techniques')
 
+    parser.add_argument('--profiles',
+                        help='Directory of extra deobfuscation profiles for --try-harder')
+
     parser.add_argument('-c', '--clobber', action='store_true',
                         help='Overwrite existing output files')
 
+    parser.add_argument('--soft-timeout', type=float,
+                        help='Interrupt the decompilation of a single file after this many seconds')
+
+    parser.add_argument('--hard-timeout', type=float,
+                        help='Kill and replace the worker handling a file after this many seconds')
+
+    parser.add_argument('--max-tasks-per-worker', dest='max_tasks', type=int,
+                        help='Replace each worker process after it has handled this many files')
+
+    parser.add_argument('--memory-budget', type=int,
+                        help='Memory in MB that all worker processes together may use')
+
+    parser.add_argument('--cache-dir',
+                        help='Directory to keep decompiled scripts in, so unchanged files are '
+                        'not decompiled again')
+
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='Size in MB the cache directory may grow to (default: 1024)')
+
+    parser.add_argument('--index',
+                        help='Result index file. APKs identical to one processed before are '
+                        'recognized by a fingerprint of their zip directory and not processed '
+                        'again')
+
+    parser.add_argument('--duplicates', choices=['skip', 'link'], default='skip',
+                        help='What to do with APKs in the result index: skip them, or hard-link '
+                        'the previous output tree to their game folder (default: skip)')
+
+    parser.add_argument('--journal',
+                        help='File to record the progress of the run in, so it can be resumed')
+
+    parser.add_argument('--resume', action='store_true',
+                        help='Continue the run recorded in the --journal file where it stopped')
+
+    parser.add_argument('--report',
+                        help='Write a json lines report of the run to this file, with a record '
+                        'per APK and per script, for tracking throughput')
+
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Also log the time spent in each stage of decompilation. This is '
+                        'always done with --report')
+
     return parser.parse_args()
 
 
@@ -295,6 +719,22 @@ def main():
     print("Version 2.0 - Refactored")
 
     args = parse_arguments()
+    if args.resume and not args.journal:
+        print("Option --resume requires --journal.")
+        sys.exit(1)
+
+    # Loaded here first, so broken profiles stop the run instead of failing scripts
+    if args.profiles:
+        if not Path(args.profiles).is_dir():
+            print(f"The profiles directory {args.profiles} does not exist.")
+            sys.exit(1)
+        import deobfuscate
+        try:
+            deobfuscate.load_profiles(args.profiles)
+        except Exception:
+            print(f"Could not load the profiles in {args.profiles}:")
+            traceback.print_exc()
+            sys.exit(1)
     tool = RenPyUnapk(args)
 
     # If no APK specified, find in current directory
@@ -305,8 +745,7 @@ def main():
             tool.logger.error("No APK files found in current directory.")
             sys.exit(1)
 
-        for apk in apk_files:
-            tool.process_apk(apk)
+        tool.process_apks(apk_files)
     else:
         apk_path = Path(args.apk)
         if not apk_path.is_file():
@@ -315,6 +754,7 @@ def main():
 
         tool.process_apk(apk_path)
 
+    tool.close()
     input('\nPress Enter to exit...')
 
 
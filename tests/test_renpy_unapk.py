@@ -0,0 +1,132 @@
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from benchmarks import corpus
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def write_apk(path, rpyc=None):
+    """Writes an APK with the game folder layout renpy-unapk expects, holding one script."""
+    if rpyc is None:
+        builder = corpus.ScriptBuilder("game/script.rpy", 0)
+        rpyc = corpus.rpyc_bytes(corpus.mixed(builder, 0.1))
+    with zipfile.ZipFile(path, "w") as apk:
+        apk.writestr("assets/x-game/x-script.rpyc", rpyc)
+        apk.writestr("assets/android-presplash.jpg", b"")
+
+
+def run_unapk(directory, *arguments):
+    # renpy-unapk waits for enter at the end
+    return subprocess.run([sys.executable, str(ROOT / "renpy-unapk.py"), *arguments],
+                          cwd=directory, input="\n", capture_output=True, text=True,
+                          timeout=300)
+
+
+class RenPyUnapkTest(unittest.TestCase):
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            write_apk(directory / "game.apk")
+
+            process = run_unapk(directory, "--report", "report.jsonl", "game.apk")
+            self.assertEqual(process.returncode, 0, process.stderr)
+            self.assertNotIn("Failed to process", process.stderr)
+            self.assertTrue((directory / "game" / "game" / "script.rpy").is_file())
+
+            with (directory / "report.jsonl").open(encoding="utf-8") as report:
+                records = [json.loads(line) for line in report]
+            self.assertEqual([record["type"] for record in records],
+                             ["run", "apk", "file", "summary"])
+
+            file_record = records[2]
+            self.assertEqual(file_record["state"], "ok")
+            self.assertTrue(file_record["path"].endswith("script.rpyc"))
+            for field in ("profile", "peak_memory", "memory", "timings"):
+                self.assertIn(field, file_record)
+
+            self.assertEqual(records[3]["files"], 1)
+            self.assertEqual(records[3]["states"], {"ok": 1})
+
+    def test_extract_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            write_apk(directory / "game.apk")
+            self.assertEqual(run_unapk(directory, "game.apk").returncode, 0)
+
+            output = directory / "game" / "game" / "script.rpy"
+            output.write_text("# edited", encoding="utf-8")
+
+            # extracting over the earlier output keeps it, unless told to clobber it
+            process = run_unapk(directory, "game.apk")
+            self.assertEqual(process.returncode, 0, process.stderr)
+            self.assertNotIn("Failed to process", process.stderr)
+            self.assertEqual(output.read_text(encoding="utf-8"), "# edited")
+
+            process = run_unapk(directory, "--clobber", "game.apk")
+            self.assertEqual(process.returncode, 0, process.stderr)
+            self.assertNotEqual(output.read_text(encoding="utf-8"), "# edited")
+
+    def test_duplicates(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            write_apk(directory / "a.apk")
+            write_apk(directory / "b.apk")
+
+            # without an apk argument, all APKs in the directory are processed as one batch
+            process = run_unapk(directory, "--index", "index.json", "--duplicates", "link")
+            self.assertEqual(process.returncode, 0, process.stderr)
+            self.assertIn("was processed before", process.stderr)
+            for name in ("a", "b"):
+                self.assertTrue((directory / name / "game" / "script.rpy").is_file())
+            with (directory / "index.json").open(encoding="utf-8") as index:
+                self.assertEqual(len(json.load(index)["apks"]), 1)
+
+    def test_failed_duplicates(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            # a script that fails to unpickle
+            rpyc = corpus.layout_rpyc(b"\x80\x02garbage")
+            write_apk(directory / "a.apk", rpyc)
+            write_apk(directory / "b.apk", rpyc)
+
+            # the output of a failed APK is not reused, nor added to the index
+            process = run_unapk(directory, "--index", "index.json", "--duplicates", "link")
+            self.assertEqual(process.returncode, 0, process.stderr)
+            self.assertNotIn("was processed before", process.stderr)
+            self.assertEqual(process.stderr.count("Extracting"), 2)
+            self.assertFalse((directory / "index.json").exists())
+
+    def test_index_options(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            builder = corpus.ScriptBuilder("game/script.rpy", 0)
+            write_apk(directory / "game.apk", corpus.rpyc_bytes(corpus.mixed(builder, 0.1),
+                                                                 corpus.layout_obfuscated))
+            output = directory / "game" / "game" / "script.rpy"
+
+            # an obfuscated script has a bad header without --try-harder, so it's not indexed
+            process = run_unapk(directory, "--index", "index.json", "game.apk")
+            self.assertEqual(process.returncode, 0, process.stderr)
+            self.assertFalse(output.exists())
+            self.assertFalse((directory / "index.json").exists())
+
+            process = run_unapk(directory, "--index", "index.json", "--try-harder", "game.apk")
+            self.assertEqual(process.returncode, 0, process.stderr)
+            self.assertNotIn("was processed before", process.stderr)
+            self.assertTrue(output.is_file())
+
+            # the same options find the earlier output, other ones don't
+            process = run_unapk(directory, "--index", "index.json", "--try-harder", "game.apk")
+            self.assertIn("was processed before", process.stderr)
+            process = run_unapk(directory, "--index", "index.json", "game.apk")
+            self.assertNotIn("was processed before", process.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
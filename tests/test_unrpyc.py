@@ -0,0 +1,207 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import decompiler
+import deobfuscate
+import unrpyc
+from benchmarks import corpus
+
+
+def corpus_asts():
+    """Yields the name and loaded AST of every file of the benchmark corpus."""
+    for name, contents, layout in corpus.CORPUS:
+        statements = contents(corpus.ScriptBuilder("game/" + name.split("/", 1)[1][:-1], 0), 1.0)
+        try_harder = layout is corpus.layout_obfuscated
+        yield name, unrpyc.load_ast(corpus.rpyc_bytes(statements, layout), try_harder)
+
+
+def write_script(path, seed=0):
+    """Writes a small rpyc file to path, and returns path."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(corpus.rpyc_bytes(corpus.mixed(corpus.ScriptBuilder("game/script.rpy",
+                                                                         seed), 0.1)))
+    return path
+
+
+class SplitTest(unittest.TestCase):
+    def test_file_processes(self):
+        # splitting a file over processes gives exactly the same output
+        for name, ast in corpus_asts():
+            with self.subTest(name):
+                expected = unrpyc.decompile(ast, init_offset=True).text
+                for processes in (2, 3):
+                    result = unrpyc.decompile(ast, init_offset=True, file_processes=processes)
+                    self.assertEqual(result.text, expected)
+
+
+class SelectTest(unittest.TestCase):
+    def setUp(self):
+        builder = corpus.ScriptBuilder("game/script.rpy", 0)
+        block = lambda: [builder.say("e")]  # noqa: E731
+        self.ast = [
+            builder.define("points", "0"),
+            builder.label("start", block),
+            builder.statement("Call", label="after_call", arguments=None, expression=False),
+            builder.label("after_call", block),
+            # a menu label, which has no block of its own
+            builder.label("choice", list),
+            builder.say("e"),
+            builder.say(),
+            builder.label("end", block),
+            builder.transform("appear"),
+        ]
+
+    def test_select_nodes(self):
+        def select(spec):
+            return decompiler.select_nodes(self.ast, decompiler.parse_selectors(spec))
+
+        self.assertEqual(select("label:start"), [1])
+        # a label printed with the call before it takes the call along
+        self.assertEqual(select("label:after_call"), [2, 3])
+        # an empty label takes the statements up to the next label along
+        self.assertEqual(select("label:choice"), [4, 5, 6])
+        # statements in init blocks select the init statement
+        self.assertEqual(select("transform:appear,label:end"), [7, 8])
+        self.assertEqual(select("label:missing"), [])
+
+    def test_only(self):
+        text = unrpyc.decompile(self.ast, only=[("label", "end")]).text
+        self.assertIn("label end:", text)
+        self.assertNotIn("label start:", text)
+        self.assertNotIn("transform appear:", text)
+
+    def test_bad_selector(self):
+        for spec in ("label", "label:", "statement:start"):
+            with self.subTest(spec), self.assertRaises(ValueError):
+                decompiler.parse_selectors(spec)
+
+
+class CacheTest(unittest.TestCase):
+    def test_hit_and_miss(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            filename = write_script(directory / "script.rpyc")
+            output = unrpyc.output_filename(filename)
+            args = unrpyc.default_args(clobber=True, cache_dir=str(directory / "cache"))
+
+            context = unrpyc.worker_common((args, filename))
+            self.assertEqual((context.state, context.cache), ("ok", "miss"))
+            expected = output.read_text(encoding="utf-8")
+            output.unlink()
+
+            context = unrpyc.worker_common((args, filename))
+            self.assertEqual((context.state, context.cache), ("ok", "hit"))
+            self.assertEqual(output.read_text(encoding="utf-8"), expected)
+
+            # options that change the output, and changes to the file, miss the cache
+            other_args = unrpyc.default_args(clobber=True, cache_dir=args.cache_dir,
+                                             init_offset=False)
+            self.assertEqual(unrpyc.worker_common((other_args, filename)).cache, "miss")
+            write_script(filename, seed=1)
+            self.assertEqual(unrpyc.worker_common((args, filename)).cache, "miss")
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = unrpyc.DecompilationCache(directory)
+            keys = [cache.key(bytes([i])) for i in range(3)]
+            for i, key in enumerate(keys):
+                cache.put(key, "x" * 100)
+                os.utime(cache.path(key), (i, i))
+
+            # the least recently used entries go first
+            self.assertEqual(cache.evict(150), 2)
+            self.assertEqual([cache.get(key) is not None for key in keys], [False, False, True])
+
+
+class ManifestTest(unittest.TestCase):
+    def test_invalidation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            filename = write_script(directory / "game" / "script.rpyc")
+            output = unrpyc.output_filename(filename)
+            output.write_text("", encoding="utf-8")
+            options = unrpyc.Manifest.options_digest(init_offset=True)
+
+            manifest = unrpyc.Manifest(unrpyc.Manifest.find(directory))
+            self.assertFalse(manifest.is_current(filename, options))
+            manifest.record(filename, options)
+            manifest.save()
+
+            # the manifest of the tree is found from inside it, and files are recorded relative
+            # to it
+            manifest = unrpyc.Manifest(unrpyc.Manifest.find(directory / "game"))
+            self.assertEqual(manifest.path, directory / unrpyc.MANIFEST_NAME)
+            self.assertEqual(list(manifest.files), ["game/script.rpyc"])
+            self.assertTrue(manifest.is_current(filename, options))
+            self.assertFalse(manifest.is_current(
+                filename, unrpyc.Manifest.options_digest(init_offset=False)))
+
+            # touching the file doesn't invalidate it, changing it does
+            stat = filename.stat()
+            os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertTrue(manifest.is_current(filename, options))
+            write_script(filename, seed=1)
+            self.assertFalse(manifest.is_current(filename, options))
+
+            # so does removing the output
+            manifest.record(filename, options)
+            self.assertTrue(manifest.is_current(filename, options))
+            output.unlink()
+            self.assertFalse(manifest.is_current(filename, options))
+
+
+class JournalTest(unittest.TestCase):
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory).resolve()
+            path = directory / "journal.jsonl"
+
+            journal = unrpyc.Journal(path)
+            journal.write(type="run")
+            for name, state in (("a.rpyc", "ok"), ("b.rpyc", "error"), ("c.rpyc", "skip")):
+                context = unrpyc.Context(directory / name)
+                context.set_state(state)
+                journal.record(context)
+            journal.close()
+            # an entry torn by a crash
+            with path.open("a", encoding="utf-8") as journal_file:
+                journal_file.write('{"file": "d.rpyc", "sta')
+
+            journal = unrpyc.Journal(path, resume=True)
+            self.assertEqual(journal.finished_files(),
+                             {str(directory / "a.rpyc"), str(directory / "c.rpyc")})
+            # a file that failed before and succeeds now is finished
+            journal.write(file=str(directory / "b.rpyc"), state="ok")
+            journal.close()
+
+            journal = unrpyc.Journal(path, resume=True)
+            self.assertEqual(len(journal.finished_files()), 3)
+            journal.close()
+
+            # without resume, the journal is started over
+            journal = unrpyc.Journal(path)
+            self.assertEqual(journal.finished_files(), set())
+            journal.close()
+            self.assertEqual(path.read_text(encoding="utf-8"), "")
+
+
+class ProfilesTest(unittest.TestCase):
+    def test_broken_profile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            profile = Path(directory) / "broken.py"
+            profile.write_text("raise RuntimeError('broken')\n", encoding="utf-8")
+
+            # a profile that failed to load isn't skipped the next time
+            for _ in range(2):
+                with self.assertRaises(RuntimeError):
+                    deobfuscate.load_profiles(directory)
+
+            profile.write_text("LOADED = True\n", encoding="utf-8")
+            deobfuscate.load_profiles(directory)
+            self.assertIn(profile.resolve(), deobfuscate.LOADED_PROFILE_FILES)
+
+
+if __name__ == "__main__":
+    unittest.main()
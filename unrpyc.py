@@ -26,30 +26,42 @@ __version__ = 'v2.0.2'
 __url__ = "https://github.com/CensoredUsername/unrpyc"
 
 
+import _thread
 import argparse
+import functools
 import glob
+import io
+import os
 import struct
 import sys
+import threading
+import time
 import traceback
 import zlib
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 
 try:
-    from multiprocessing import Pool, cpu_count
+    from multiprocessing import Pipe, Pool, Process, cpu_count
+    from multiprocessing.connection import wait
 except ImportError:
     # Mock required support when multiprocessing is unavailable
     def cpu_count():
         return 1
 
+# deobfuscate, decompiler.astdump and decompiler.translate are only needed for some options,
+# so they are imported where they're used. The same goes for hashlib and json, which are only
+# used by the decompilation cache, and psutil, which is only used to measure memory.
 import decompiler
-import deobfuscate
-from decompiler import astdump, translate
 from decompiler.renpycompat import (pickle_safe_loads, pickle_safe_dumps, pickle_loads,
                                     pickle_detect_python2)
 
 
 class Context:
-    def __init__(self):
+    def __init__(self, filename=None):
+        # the file this context is about, if any
+        self.filename = filename
+
         # list of log lines to print
         self.log_contents = []
 
@@ -62,14 +74,67 @@ class Context:
         #     ok:         the process concluded successfully
         #     bad_header: the given file cannot be parsed as a normal rpyc file
         #     skip:       the given file was skipped due to a preexisting output file
+        #     timeout:    processing the given file exceeded the configured time limit
+        #     unselected: the given file contains none of the statements selected with --only
         self.state = "error"
 
+        # whether the output was taken from the decompilation cache ("hit"), or had to be
+        # decompiled and was added to it ("miss"). None when no cache is used.
+        self.cache = None
+
         # return value from the worker, if any
         self.value = None
 
+        # wall and cpu time in seconds spent in each stage of processing, as
+        # {stage: [wall, cpu]}. Time spent in a stage nested in another one only counts for the
+        # inner stage. See STAGES for the stages.
+        self.timings = {}
+        # the stages currently being timed, innermost last, with the time spent in the stages
+        # nested in them so far
+        self.stages = []
+
+        # size of the decompressed pickle, and amount of statements in the ast, once known
+        self.inflated_size = None
+        self.node_count = None
+
+        # the messages in log_contents that are warnings about the file
+        self.warnings = []
+
+        # wall time in seconds the worker spent on the file
+        self.duration = None
+
+        # path of the profile written because the file was slow, see --profile-slow
+        self.profile = None
+
+        # the decompiler.NodeStats of the file, when collected
+        self.node_stats = None
+
+        # peak memory in bytes while loading ("load") and decompiling ("decompile") the file,
+        # and the highest of those, when measured. See MemoryTracker
+        self.memory = {}
+        self.peak_memory = None
+
     def log(self, message):
         self.log_contents.append(message)
 
+    @contextmanager
+    def stage(self, name):
+        """Times the code in the with block as the stage called name."""
+        nested = [0.0, 0.0]
+        self.stages.append(nested)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self.stages.pop()
+            if self.stages:
+                self.stages[-1][0] += wall
+                self.stages[-1][1] += cpu
+            timing = self.timings.setdefault(name, [0.0, 0.0])
+            timing[0] += wall - nested[0]
+            timing[1] += cpu - nested[1]
+
     def set_error(self, error):
         self.error = error
 
@@ -80,18 +145,218 @@ class Context:
         self.state = state
 
 
+# The stages Context.stage is used for, in the order they happen
+STAGES = ("read", "slots", "inflate", "detect", "unpickle", "deobfuscate", "translate",
+          "decompile", "write")
+
+
+class StageWriter:
+    """
+    Wraps a file object, timing every write to it as the write stage of context. The decompilers
+    and the ast dumper already collect their output and write it in large chunks (see
+    decompiler.util.OutputBuffer), which are passed straight through, so the output is still
+    streamed while being written.
+    """
+
+    def __init__(self, out_file, context):
+        self.out_file = out_file
+        self.context = context
+
+    def write(self, text):
+        with self.context.stage("write"):
+            self.out_file.write(text)
+
+
+def count_nodes(ast):
+    """Counts the statements in ast, including those in the blocks of other statements."""
+    count = 0
+    blocks = [ast] if isinstance(ast, (list, tuple)) else []
+    while blocks:
+        for node in blocks.pop():
+            count += 1
+            block = getattr(node, "block", None)
+            if isinstance(block, (list, tuple)):
+                blocks.append(block)
+            # menu items and if entries keep their blocks last
+            for entry in getattr(node, "items", None) or getattr(node, "entries", None) or ():
+                if isinstance(entry, tuple) and isinstance(entry[-1], list):
+                    blocks.append(entry[-1])
+    return count
+
+
+class Report:
+    """
+    A machine readable report of a run, as one json object per line. The "type" of the first
+    record is "run", describing the tool, version, host and settings. It's followed by a "file"
+    record for every processed file (see `file_record`), "apk" records from renpy-unapk, and
+    finally a "summary" record with the counts of each state and the throughput.
+    """
+
+    def __init__(self, path, tool, **settings):
+        import platform
+
+        self.file = open(path, 'w', encoding='utf-8')
+        self.started = time.perf_counter()
+        self.write(type="run", tool=tool, version=__version__, host=platform.node(),
+                   python=platform.python_version(), started=time.time(), **settings)
+
+    def write(self, **record):
+        import json
+
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def file_record(self, context, dump=False, only=False):
+        """
+        Writes the record of a processed file, and returns it. It has the path, state, whether
+        the output was cached, the duration and stage timings in seconds, the size of the input,
+        the inflated pickle and the output in bytes, the amount of statements, the warnings, the
+        type of error if there was one, and the throughput in MB/s.
+        """
+        def size(path):
+            try:
+                return path.stat().st_size
+            except (OSError, TypeError):
+                return None
+
+        filename = None if context.filename is None else Path(context.filename)
+        input_size = size(filename)
+        output_size = None
+        if context.state == "ok" and filename is not None:
+            output_size = size(output_filename(filename, dump, only))
+
+        error = None
+        if context.error is not None:
+            error = type(context.error).__qualname__
+            if type(context.error).__module__ != "builtins":
+                error = f"{type(context.error).__module__}.{error}"
+
+        throughput = None
+        if input_size is not None and context.duration:
+            throughput = input_size / (1024 * 1024) / context.duration
+
+        record = dict(
+            type="file", path=None if filename is None else str(filename), state=context.state,
+            cache=context.cache, duration=context.duration,
+            timings={stage: {"wall": wall, "cpu": cpu}
+                     for stage, (wall, cpu) in context.timings.items()},
+            input_size=input_size, inflated_size=context.inflated_size, output_size=output_size,
+            node_count=context.node_count, warnings=context.warnings, profile=context.profile,
+            peak_memory=context.peak_memory, memory=context.memory,
+            error=error,
+            throughput=throughput)
+        self.write(**record)
+        return record
+
+    def close(self, file_records, **extra):
+        """Writes the summary record for the given file records, and closes the report."""
+        wall = time.perf_counter() - self.started
+        states = {}
+        for record in file_records:
+            states[record["state"]] = states.get(record["state"], 0) + 1
+        input_size = sum(record["input_size"] or 0 for record in file_records)
+
+        self.write(type="summary", files=len(file_records), states=states, wall=wall,
+                   input_size=input_size, throughput=input_size / (1024 * 1024) / wall, **extra)
+        self.file.close()
+
+
+def timing_summary(results):
+    """
+    Aggregates the stage timings of results into lines of text: the total wall and cpu time
+    spent in each stage over all files, and percentiles of the wall time per file.
+    """
+    def percentile(values, fraction):
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    lines = []
+    stages = [stage for stage in STAGES if any(stage in result.timings for result in results)]
+    if not stages:
+        return lines
+
+    lines.append(f"{'Stage':<12}{'wall s':>9}{'cpu s':>9}{'p50 ms':>9}{'p90 ms':>9}{'max ms':>9}")
+    for stage in stages:
+        timings = [result.timings[stage] for result in results if stage in result.timings]
+        walls = sorted(wall * 1000 for wall, _ in timings)
+        lines.append(f"{stage:<12}{sum(walls) / 1000:>9.2f}"
+                     f"{sum(cpu for _, cpu in timings):>9.2f}{percentile(walls, 0.5):>9.1f}"
+                     f"{percentile(walls, 0.9):>9.1f}{walls[-1]:>9.1f}")
+
+    # Statements are only counted in files that were decompiled, not in the ones without any
+    # statements selected with --only, so they're only given when every inflated file has a count.
+    sizes = [result.inflated_size for result in results if result.inflated_size is not None]
+    nodes = [result.node_count for result in results if result.inflated_size is not None
+             and result.node_count is not None]
+    if sizes and len(nodes) == len(sizes):
+        lines.append(f"Inflated {sum(sizes) / (1024 * 1024):.1f} MB of pickles, "
+                     f"containing {sum(nodes)} statements.")
+    elif sizes:
+        lines.append(f"Inflated {sum(sizes) / (1024 * 1024):.1f} MB of pickles.")
+    return lines
+
+
+# Amount of files listed by memory_summary
+MEMORY_SUMMARY_FILES = 5
+
+def memory_summary(results):
+    """
+    Summarizes the peak memory of results into lines of text: percentiles over all files, and
+    the files that needed the most.
+    """
+    measured = sorted((result for result in results if result.peak_memory is not None),
+                      key=lambda result: result.peak_memory)
+    if not measured:
+        return []
+
+    def mb(size):
+        return f"{size / (1024 * 1024):.1f} MB"
+
+    peaks = [result.peak_memory for result in measured]
+    lines = [f"p50 {mb(peaks[len(peaks) // 2])}, p90 {mb(peaks[int(0.9 * len(peaks))])}, "
+             f"max {mb(peaks[-1])}"]
+    for result in reversed(measured[-MEMORY_SUMMARY_FILES:]):
+        phases = ", ".join(f"{phase} {mb(peak)}" for phase, peak in result.memory.items())
+        lines.append(f"{mb(result.peak_memory):>10}  {result.filename} ({phases})")
+    return lines
+
+
 class BadRpycException(Exception):
     """Exception raised when we couldn't parse the rpyc archive format"""
     pass
 
 
+class DecompileWarning:
+    """
+    Something worth knowing about that came up while decompiling a file, but didn't stop it.
+    `stage` is "load" for messages from reading the rpyc file, "decompile" for those from the
+    decompiler. `message` is the text unrpyc would log for it.
+    """
+    def __init__(self, stage, message):
+        self.stage = stage
+        self.message = message
+
+    def __repr__(self):
+        return f'DecompileWarning({self.stage!r}, {self.message!r})'
+
+
+class DecompileResult:
+    """
+    The result of `decompile`. `text` is the decompiled script, or None when it was written to
+    an out_file instead. `warnings` is a list of `DecompileWarning`.
+    """
+    def __init__(self, text, warnings):
+        self.text = text
+        self.warnings = warnings
+
+
 # API
 
 def read_ast_from_file(in_file, context):
     # Reads rpyc v1 or v2 file
     # v1 files are just a zlib compressed pickle blob containing some data and the ast
     # v2 files contain a basic archive structure that can be parsed to find the same blob
-    raw_contents = in_file.read()
+    with context.stage("read"):
+        raw_contents = in_file.read()
     file_start = raw_contents[:50]
     is_rpyc_v1 = False
 
@@ -101,46 +366,51 @@ def read_ast_from_file(in_file, context):
         is_rpyc_v1 = True
 
     else:
-        # parse the archive structure
-        position = 10
-        chunks = {}
-        have_errored = False
+        with context.stage("slots"):
+            # parse the archive structure
+            position = 10
+            chunks = {}
+            have_errored = False
 
-        for expected_slot in range(1, 0xFFFFFFFF):
-            slot, start, length = struct.unpack("III", raw_contents[position: position + 12])
+            for expected_slot in range(1, 0xFFFFFFFF):
+                slot, start, length = struct.unpack("III", raw_contents[position: position + 12])
 
-            if slot == 0:
-                break
+                if slot == 0:
+                    break
 
-            if slot != expected_slot and not have_errored:
-                have_errored = True
+                if slot != expected_slot and not have_errored:
+                    have_errored = True
 
-                context.log(
-                    "Warning: Encountered an unexpected slot structure. It is possible the \n"
-                    "    file header structure has been changed.")
+                    context.log(
+                        "Warning: Encountered an unexpected slot structure. It is possible the \n"
+                        "    file header structure has been changed.")
 
-            position += 12
+                position += 12
 
-            chunks[slot] = raw_contents[start: start + length]
+                chunks[slot] = raw_contents[start: start + length]
 
-        if 1 not in chunks:
-            context.set_state('bad_header')
-            raise BadRpycException(
-                "Unable to find the right slot to load from the rpyc file. The file header "
-                f"structure has been changed. File header: {file_start}")
+            if 1 not in chunks:
+                context.set_state('bad_header')
+                raise BadRpycException(
+                    "Unable to find the right slot to load from the rpyc file. The file header "
+                    f"structure has been changed. File header: {file_start}")
 
-        contents = chunks[1]
+            contents = chunks[1]
 
     try:
-        contents = zlib.decompress(contents)
+        with context.stage("inflate"):
+            contents = zlib.decompress(contents)
     except Exception:
         context.set_state('bad_header')
         raise BadRpycException(
             "Did not find a zlib compressed blob where it was expected. Either the header has been "
             f"modified or the file structure has been changed. File header: {file_start}") from None
+    context.inflated_size = len(contents)
 
     # add some detection of ren'py 7 files
-    if is_rpyc_v1 or pickle_detect_python2(contents):
+    with context.stage("detect"):
+        python2 = is_rpyc_v1 or pickle_detect_python2(contents)
+    if python2:
         version = "6" if is_rpyc_v1 else "7"
 
         context.log(
@@ -149,10 +419,28 @@ def read_ast_from_file(in_file, context):
             "    version 8. Decompilation will still be attempted, but errors or incorrect \n"
             "    decompilation might occur. ")
 
-    _, stmts = pickle_safe_loads(contents)
+    with context.stage("unpickle"):
+        _, stmts = pickle_safe_loads(contents)
     return stmts
 
 
+def load_ast(data, try_harder=False, context=None):
+    """
+    Loads the AST from the contents of an rpyc file, given as a bytes-like object or as a binary
+    file object. If try_harder is True, an attempt will be made to work around obfuscation
+    techniques. Else, it is loaded as a normal rpyc file.
+    """
+    context = context or Context()
+    in_file = io.BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+
+    if try_harder:
+        import deobfuscate
+        with context.stage("deobfuscate"):
+            return deobfuscate.read_ast(in_file, context)
+    else:
+        return read_ast_from_file(in_file, context)
+
+
 def get_ast(in_file, try_harder, context):
     """
     Opens the rpyc file at path in_file to load the contained AST.
@@ -160,17 +448,392 @@ def get_ast(in_file, try_harder, context):
     Else, it is loaded as a normal rpyc file.
     """
     with in_file.open('rb') as in_file:
-        if try_harder:
-            ast = deobfuscate.read_ast(in_file, context)
+        return load_ast(in_file, try_harder, context)
+
+
+def decompile_ast(ast, out_file=None, context=None, dump=False, comparable=False,
+                  no_pyexpr=False, translator=None, init_offset=True, sl_custom_names=None,
+                  file_processes=1, only=None, node_stats=None):
+    """
+    Decompiles an already loaded AST. The output is streamed into out_file, which can be any
+    object with a write method accepting str, and None is returned. Without out_file, the output
+    is returned as a str instead. Messages from the decompiler are logged to context.
+    The options and their defaults are the same as for `decompile_rpyc`, and like on the command
+    line init_offset is on unless turned off. If node_stats is a decompiler.NodeStats,
+    the printed nodes are counted and timed in it.
+    """
+    context = context or Context()
+    writer = io.StringIO() if out_file is None else StageWriter(out_file, context)
+    context.node_count = count_nodes(ast)
+
+    with context.stage("decompile"):
+        if dump:
+            from decompiler import astdump
+            astdump.pprint(writer, ast, comparable=comparable, no_pyexpr=no_pyexpr)
         else:
-            ast = read_ast_from_file(in_file, context)
-    return ast
+            options = decompiler.Options(log=context.log_contents, translator=translator,
+                                         init_offset=init_offset, sl_custom_names=sl_custom_names,
+                                         processes=file_processes, only=only,
+                                         timer=context.stage, stats=node_stats)
 
+            decompiler.pprint(writer, ast, options)
+
+    if out_file is None:
+        return writer.getvalue()
+
+
+def decompile(source, out_file=None, try_harder=False, **options):
+    """
+    Decompiles an rpyc file entirely in memory. source is the contents of the file as a
+    bytes-like object or binary file object, or its already loaded AST (see `load_ast`).
+    Returns a `DecompileResult`, which holds the text unless out_file was given (see
+    `decompile_ast`, which also takes the same keyword options), and any warnings.
+
+    Errors are raised as exceptions, BadRpycException if the file structure can't be parsed.
+    """
+    context = Context()
+
+    if isinstance(source, list):
+        ast = source
+    else:
+        ast = load_ast(source, try_harder, context)
+    loaded = len(context.log_contents)
+
+    text = decompile_ast(ast, out_file, context, **options)
+
+    warnings = [DecompileWarning("load" if i < loaded else "decompile", message)
+                for i, message in enumerate(context.log_contents)]
+    return DecompileResult(text, warnings)
+
+
+# Amount of compressed data inflated to estimate the compression ratio of a file, and the maximum
+# amount of data this may inflate to.
+COST_SAMPLE_SIZE = 1 << 16
+COST_SAMPLE_LIMIT = 1 << 20
+
+# Files that can't be parsed normally get this cost per byte when deobfuscation is attempted,
+# as the fallback strategies scan and try to inflate the whole file, multiple times.
+TRY_HARDER_COST_FACTOR = 20
+
+
+def estimate_inflated_size(filename):
+    """
+    Cheaply estimates the size of the pickle inside the rpyc file at filename. This reads the
+    slot table of the RPC2 header, inflates only the start of the zlib stream in slot 1, and
+    extrapolates its compression ratio over the rest of the slot. Returns None if the file does
+    not have a normal rpyc structure.
+    """
+    try:
+        with filename.open('rb') as f:
+            if f.read(10) == b"RENPY RPC2":
+                while True:
+                    entry = f.read(12)
+                    if len(entry) != 12:
+                        return None
+
+                    slot, start, length = struct.unpack("<III", entry)
+                    if slot == 0:
+                        return None
+                    if slot == 1:
+                        break
+
+            else:
+                # rpyc v1 files are just the zlib blob
+                start, length = 0, filename.stat().st_size
+
+            f.seek(start)
+            sample = f.read(min(length, COST_SAMPLE_SIZE))
+
+    except OSError:
+        return None
+
+    decompressor = zlib.decompressobj()
+    try:
+        inflated = len(decompressor.decompress(sample, COST_SAMPLE_LIMIT))
+    except zlib.error:
+        return None
+
+    if decompressor.eof:
+        return inflated
+
+    consumed = len(sample) - len(decompressor.unconsumed_tail)
+    if not consumed:
+        return None
+
+    return inflated * length // consumed
+
+
+def sort_by_cost(worklist, try_harder=False):
+    """
+    Sorts worklist in place so the files that will take longest to decompile come first, which
+    keeps a big file from being started last and running alone at the end of a batch.
+    """
+    def cost(filename):
+        estimate = estimate_inflated_size(filename)
+        if estimate is not None:
+            return estimate
+
+        size = filename.stat().st_size
+        return size * TRY_HARDER_COST_FACTOR if try_harder else size
+
+    worklist.sort(key=cost, reverse=True)
+
+
+@contextmanager
+def atomic_open(path):
+    """
+    Opens the file at path for writing text. The writes go to a temporary file next to it, which
+    only replaces path once it has been written completely, so an interrupted run never leaves a
+    partially written file behind.
+    """
+    temp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        with temp.open('w', encoding='utf-8') as out_file:
+            yield out_file
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            temp.unlink()
+        except OSError:
+            pass
+        raise
 
-def decompile_rpyc(input_filename, context, overwrite=False, try_harder=False, dump=False,
-                   comparable=False, no_pyexpr=False, translator=None, init_offset=False,
-                   sl_custom_names=None):
 
+# Bump this when the way entries are stored changes, so older entries are no longer used.
+CACHE_FORMAT = 1
+
+class DecompilationCache:
+    """
+    A directory of decompiled scripts, addressed by a hash of the rpyc file they were decompiled
+    from, the unrpyc version, and all options that affect the output. Entries are written
+    atomically so workers and concurrent runs can share a cache. Using an entry updates its
+    modification time, which `evict` uses to remove the least recently used entries first.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def key(self, data, **options):
+        import hashlib
+        import json
+
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps([__version__, CACHE_FORMAT, options], sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return self.directory / key[:2] / f'{key}.rpy'
+
+    def get(self, key):
+        """Returns the cached output for key, or None if there isn't any."""
+        path = self.path(key)
+        try:
+            text = path.read_text(encoding='utf-8')
+            os.utime(path)
+        except (OSError, UnicodeDecodeError):
+            return None
+        return text
+
+    def put(self, key, text):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with atomic_open(path) as out_file:
+            out_file.write(text)
+
+    def evict(self, max_size):
+        """
+        Removes the least recently used entries until the cache holds at most max_size bytes.
+        Returns the amount of entries that were removed.
+        """
+        entries = []
+        for path in self.directory.glob('*/*.rpy'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= max_size:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+MANIFEST_NAME = 'unrpyc-manifest.json'
+MANIFEST_FORMAT = 1
+
+class Manifest:
+    """
+    Records for every file decompiled in a tree what it was decompiled from: the size,
+    modification time and hash of the input file, and a digest of the unrpyc version and the
+    options used. A file only has to be decompiled again when this no longer matches.
+    The manifest is kept at path, normally in the root of the tree (see `find`), and is only read
+    and written by the main process. Files are recorded relative to the directory it is in, or
+    by their absolute path when they are outside of it.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.root = self.path.parent
+        self.files = {}
+
+        try:
+            with self.path.open('r', encoding='utf-8') as manifest_file:
+                import json
+                contents = json.load(manifest_file)
+        except (OSError, ValueError):
+            return
+        if isinstance(contents, dict) and contents.get('format') == MANIFEST_FORMAT:
+            self.files = contents.get('files', {})
+
+    @staticmethod
+    def options_digest(**options):
+        import hashlib
+        import json
+
+        options = json.dumps([__version__, options], sort_keys=True).encode()
+        return hashlib.sha256(options).hexdigest()
+
+    @staticmethod
+    def file_digest(filename):
+        import hashlib
+
+        digest = hashlib.sha256()
+        with filename.open('rb') as in_file:
+            for block in iter(lambda: in_file.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @staticmethod
+    def find(directory):
+        """
+        Returns the path of the manifest of the tree directory is in: the nearest one in
+        directory or its parents, so decompiling part of a tree uses the manifest of the whole
+        tree. Without any, the manifest is placed in directory.
+        """
+        directory = Path(directory)
+        for parent in (directory, *directory.parents):
+            if (parent / MANIFEST_NAME).is_file():
+                return parent / MANIFEST_NAME
+        return directory / MANIFEST_NAME
+
+    def key(self, filename):
+        try:
+            return filename.relative_to(self.root).as_posix()
+        except ValueError:
+            return filename.as_posix()
+
+    def is_current(self, filename, options, dump=False, only=False):
+        """
+        Returns if filename was decompiled with options before, to an output file that still
+        exists, and has not changed since. The file is only hashed when its size or
+        modification time changed.
+        """
+        entry = self.files.get(self.key(filename))
+        if entry is None or entry['options'] != options:
+            return False
+
+        if not output_filename(filename, dump, only).exists():
+            return False
+
+        stat = filename.stat()
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+
+        if entry['size'] != stat.st_size or entry['sha256'] != self.file_digest(filename):
+            return False
+
+        # the file was touched without changing it
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def owns_output(self, filename):
+        """Returns if the output of filename was written by a run recorded in the manifest."""
+        return self.key(filename) in self.files
+
+    def record(self, filename, options):
+        stat = filename.stat()
+        self.files[self.key(filename)] = {
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha256': self.file_digest(filename), 'options': options}
+
+    def save(self):
+        import json
+
+        with atomic_open(self.path) as manifest_file:
+            json.dump({'format': MANIFEST_FORMAT, 'files': self.files}, manifest_file,
+                      indent=1, sort_keys=True)
+
+
+# Entries in the journal with these states don't need to be processed again when resuming
+JOURNAL_FINISHED_STATES = ("ok", "skip", "unselected", "bad_header")
+
+class Journal:
+    """
+    An append-only record of the progress of a batch run, as one json object per line. Every
+    entry is flushed to disk as soon as it is written, so when a run is interrupted it can be
+    resumed where it stopped. Entries for files have "file" and "state" keys, other entries are
+    up to the user.
+
+    Without resume, the journal is started over. With resume, its entries are read back first.
+    A torn last line from a crash is ignored.
+    """
+
+    def __init__(self, path, resume=False):
+        import json
+
+        self.path = Path(path)
+        self.entries = []
+
+        contents = ''
+        if resume:
+            try:
+                contents = self.path.read_text(encoding='utf-8')
+            except OSError:
+                pass
+
+        for line in contents.splitlines():
+            try:
+                self.entries.append(json.loads(line))
+            except ValueError:
+                pass
+
+        self.file = self.path.open('a' if resume else 'w', encoding='utf-8')
+        if contents and not contents.endswith('\n'):
+            # finish the torn line, so it doesn't corrupt the next entry
+            self.file.write('\n')
+
+    def write(self, **entry):
+        import json
+
+        self.entries.append(entry)
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def record(self, context):
+        if context.filename is not None:
+            self.write(file=str(Path(context.filename).resolve()), state=context.state)
+
+    def finished_files(self):
+        """The files that were processed in a previous run, as resolved path strings."""
+        states = {entry['file']: entry['state'] for entry in self.entries if 'file' in entry}
+        return {filename for filename, state in states.items()
+                if state in JOURNAL_FINISHED_STATES}
+
+    def close(self):
+        self.file.close()
+
+
+def output_filename(input_filename, dump=False, only=False):
     # Output filename is input filename but with .rpy extension
     if dump:
         ext = '.txt'
@@ -178,7 +841,18 @@ def decompile_rpyc(input_filename, context, overwrite=False, try_harder=False, d
         ext = '.rpy'
     elif input_filename.suffix == ('.rpymc'):
         ext = '.rpym'
-    out_filename = input_filename.with_suffix(ext)
+    # The selection of --only gets a name of its own, so it's never mistaken for the full output
+    if only:
+        ext = '.only' + ext
+    return input_filename.with_suffix(ext)
+
+
+def decompile_rpyc(input_filename, context, overwrite=False, try_harder=False, dump=False,
+                   comparable=False, no_pyexpr=False, translator=None, init_offset=True,
+                   sl_custom_names=None, file_processes=1, only=None, cache=None,
+                   translator_digest=None, memory=None, node_stats=None):
+
+    out_filename = output_filename(input_filename, dump, only is not None)
 
 
     if not overwrite and out_filename.exists():
@@ -187,18 +861,74 @@ def decompile_rpyc(input_filename, context, overwrite=False, try_harder=False, d
         return
 
     context.log(f'Decompiling {input_filename} to {out_filename.name} ...')
-    ast = get_ast(input_filename, try_harder, context)
 
-    with out_filename.open('w', encoding='utf-8') as out_file:
-        if dump:
-            astdump.pprint(out_file, ast, comparable=comparable, no_pyexpr=no_pyexpr)
+    # anything logged while loading and decompiling the file is a warning about it
+    warnings_start = len(context.log_contents)
+    track_memory = nullcontext if memory is None else functools.partial(memory.track, context)
+    try:
+        if cache is None:
+            with track_memory("load"):
+                ast = get_ast(input_filename, try_harder, context)
         else:
-            options = decompiler.Options(log=context.log_contents, translator=translator,
-                                         init_offset=init_offset, sl_custom_names=sl_custom_names)
+            # The translator is represented by a digest of its pickled form, as it is large.
+            data = input_filename.read_bytes()
+            key = cache.key(data, dump=dump, comparable=comparable, no_pyexpr=no_pyexpr,
+                            translator=translator_digest, init_offset=init_offset,
+                            sl_custom_names=sl_custom_names, only=only)
+            text = cache.get(key)
+            if text is not None:
+                context.log('Using the cached result.')
+                warnings_start = len(context.log_contents)
+                with context.stage("write"), atomic_open(out_filename) as out_file:
+                    out_file.write(text)
+                context.cache = 'hit'
+                context.set_state('ok')
+                return
+
+            context.cache = 'miss'
+            with track_memory("load"):
+                ast = load_ast(data, try_harder, context)
+
+        if only is not None and not decompiler.select_nodes(ast, only):
+            context.log(f'None of the selected statements are in {input_filename}.')
+            context.set_state('unselected')
+            return
+
+        options = dict(dump=dump, comparable=comparable, no_pyexpr=no_pyexpr, translator=translator,
+                       init_offset=init_offset, sl_custom_names=sl_custom_names,
+                       file_processes=file_processes, only=only, node_stats=node_stats)
+
+        if cache is None:
+            with atomic_open(out_filename) as out_file, track_memory("decompile"):
+                decompile_ast(ast, out_file, context, **options)
+
+        else:
+            with track_memory("decompile"):
+                text = decompile_ast(ast, None, context, **options)
+            with context.stage("write"), atomic_open(out_filename) as out_file:
+                out_file.write(text)
+            cache.put(key, text)
 
-            decompiler.pprint(out_file, ast, options)
+        context.set_state('ok')
+    finally:
+        context.warnings = context.log_contents[warnings_start:]
 
-    context.set_state('ok')
+
+def default_args(**overrides):
+    """
+    Returns the argument namespace `worker_common`, `worker_tl` and `run_workers` expect, with
+    the defaults of the command line options and any overrides applied. Tools running the
+    workers outside of `main` start from this, so they don't have to know every option.
+    """
+    args = argparse.Namespace(
+        clobber=False, try_harder=False, dump=False, no_pyexpr=False, comparable=False,
+        init_offset=True, sl_custom_names=None, translate=None, translator=None, profiles=None,
+        file_processes=1, only=None, cache_dir=None, cache_size=1024, replace_outputs=frozenset(),
+        soft_timeout=None, hard_timeout=None, max_tasks=None, memory_budget=None,
+        track_memory=None, node_stats=False, profile_slow=None, profile_all=False,
+        profile_dir=None)
+    vars(args).update(overrides)
+    return args
 
 
 def worker_tl(arg_tup):
@@ -208,12 +938,17 @@ def worker_tl(arg_tup):
     arg_tup is (args, filename). Returns the gathered TL data in the context.
     """
     args, filename = arg_tup
-    context = Context()
+    context = Context(filename)
 
     try:
+        if args.profiles:
+            import deobfuscate
+            deobfuscate.load_profiles(args.profiles)
+
         context.log(f'Extracting translations from {filename}...')
         ast = get_ast(filename, args.try_harder, context)
 
+        from decompiler import translate
         tl_inst = translate.Translator(args.translate, True)
         tl_inst.translate_dialogue(ast)
 
@@ -237,54 +972,584 @@ def worker_common(arg_tup):
     """
 
     args, filename = arg_tup
-    context = Context()
+    context = Context(filename)
 
-    if args.translator:
-        args.translator = pickle_loads(args.translator)
+    # args is shared between calls when no worker processes are used, so leave it untouched
+    translator = pickle_loads(args.translator) if args.translator else None
 
+    cache = translator_digest = None
+    if args.cache_dir:
+        cache = DecompilationCache(args.cache_dir)
+        if args.translator:
+            import hashlib
+            translator_digest = hashlib.sha256(args.translator).hexdigest()
+
+    if args.node_stats:
+        context.node_stats = decompiler.NodeStats()
+
+    profiler = None
+    if args.profile_all:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    started = time.perf_counter()
     try:
-        decompile_rpyc(
-            filename, context, overwrite=args.clobber, try_harder=args.try_harder,
+        if args.profiles:
+            import deobfuscate
+            deobfuscate.load_profiles(args.profiles)
+
+        options = dict(
+            overwrite=args.clobber or filename in args.replace_outputs,
+            try_harder=args.try_harder,
             dump=args.dump, no_pyexpr=args.no_pyexpr, comparable=args.comparable,
             init_offset=args.init_offset, sl_custom_names=args.sl_custom_names,
-            translator=args.translator)
+            translator=translator, file_processes=args.file_processes, only=args.only,
+            cache=cache, translator_digest=translator_digest,
+            memory=MemoryTracker(args.track_memory) if args.track_memory else None,
+            node_stats=context.node_stats)
+
+        if profiler is None:
+            decompile_rpyc(filename, context, **options)
+        else:
+            profiler.runcall(decompile_rpyc, filename, context, **options)
 
     except Exception as e:
         context.set_error(e)
         context.log(f'Error while decompiling {filename}:')
         context.log(traceback.format_exc())
 
+    context.duration = time.perf_counter() - started
+
+    if profiler is not None:
+        # The file is finished, so neither an error nor the soft time limit going off while
+        # writing its profile may change its result.
+        try:
+            save_profile_part(args, filename, profiler)
+        except (Exception, KeyboardInterrupt):
+            context.log(f'Error while profiling {filename}:')
+            context.log(traceback.format_exc())
+
     return context
 
 
-def run_workers(worker, common_args, private_args, parallelism):
+# Amount of functions listed in the text version of a profile
+PROFILE_TEXT_ENTRIES = 40
+# Folder in the profile directory that --profile-all collects the profiles of files in
+PROFILE_ALL_PARTS = '.unrpyc-profile-parts'
+
+
+def profile_name(filename):
+    # the file name, and a hash of the full path to tell files with the same name apart
+    import hashlib
+
+    return f'{filename.stem}-{hashlib.sha1(str(filename).encode()).hexdigest()[:8]}'
+
+
+def write_profile(stats, path):
+    """
+    Writes pstats.Stats to path with the .prof suffix, for use with pstats or other profile
+    viewers, and a text listing of the most expensive functions next to it with the .txt suffix.
+    """
+    import pstats
+
+    stats.dump_stats(path.with_suffix('.prof'))
+    with path.with_suffix('.txt').open('w', encoding='utf-8') as text_file:
+        stats = pstats.Stats(str(path.with_suffix('.prof')), stream=text_file)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TEXT_ENTRIES)
+
+
+def save_profile_part(args, filename, profiler):
+    """
+    Keeps the profile of a file processed under profiler with --profile-all, for aggregation by
+    `merge_profiles`.
+    """
+    parts = Path(args.profile_dir) / PROFILE_ALL_PARTS
+    parts.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(parts / f'{profile_name(filename)}.prof')
+
+
+def profile_slow_files(args, results):
+    """
+    Handles --profile-slow after all files were processed. Every file that took longer than
+    --profile-slow seconds is decompiled again in memory under a profiler, in this process, so
+    this isn't subject to the time limits of the workers, and files that aren't slow don't pay
+    for profiling. The profiles are written to the profile directory and recorded in the
+    results, which are otherwise left as they are. With --profile-all the profile is already
+    there, so this has to be done before `merge_profiles` removes it.
+    """
+    import cProfile
+    import pstats
+
+    translator = pickle_loads(args.translator) if args.translator else None
+    for context in results:
+        if (context.filename is None or context.duration is None
+                or context.duration < args.profile_slow or context.state not in ("ok", "error")):
+            continue
+
+        filename = Path(context.filename)
+        part = Path(args.profile_dir) / PROFILE_ALL_PARTS / f'{profile_name(filename)}.prof'
+        path = Path(args.profile_dir) / f'{profile_name(filename)}.prof'
+        try:
+            if args.profile_all and part.exists():
+                stats = pstats.Stats(str(part))
+            else:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.runcall(
+                        decompile, filename.read_bytes(), try_harder=args.try_harder,
+                        dump=args.dump, comparable=args.comparable, no_pyexpr=args.no_pyexpr,
+                        translator=translator, init_offset=args.init_offset,
+                        sl_custom_names=args.sl_custom_names, only=args.only)
+                except Exception:
+                    # the profile up to the error is still interesting
+                    pass
+                stats = pstats.Stats(profiler)
+            write_profile(stats, path)
+        except Exception:
+            print(f'Error while writing the profile of {filename}:')
+            print(traceback.format_exc())
+            continue
+        context.profile = str(path)
+        print(f'{filename} took {context.duration:.1f}s, its profile was written to {path}.')
+
+
+def merge_profiles(profile_dir):
+    """
+    Combines the profiles collected by --profile-all into a single profile of the whole run,
+    written to unrpyc-all.prof in profile_dir. Returns its path, or None if there were none.
+    """
+    import pstats
+    import shutil
+
+    parts = Path(profile_dir) / PROFILE_ALL_PARTS
+    paths = [str(path) for path in parts.glob('*.prof')]
+    if not paths:
+        return None
+
+    path = Path(profile_dir) / 'unrpyc-all.prof'
+    write_profile(pstats.Stats(*paths), path)
+    shutil.rmtree(parts)
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def import_psutil():
+    """
+    Returns the psutil module, or None if it isn't installed. Memory sizes are then read from
+    /proc instead, where available. Importing is only tried once.
+    """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil
+
+
+def current_rss():
+    """
+    Returns the resident set size of the current process in bytes, or None if unknown.
+    """
+    psutil = import_psutil()
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def available_memory():
+    """
+    Returns the amount of memory available to new work on this system in bytes, or None if
+    unknown.
+    """
+    psutil = import_psutil()
+    if psutil is not None:
+        return psutil.virtual_memory().available
+
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of the current process in bytes since the last
+    `reset_peak_rss`, or None if unknown. Only available on Linux.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size of the current process to the current one. Returns if
+    this is supported.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return peak_rss() is not None
+
+
+# Interval in seconds at which the resident set size is sampled when the peak can't be reset
+MEMORY_SAMPLE_INTERVAL = 0.01
+
+class MemoryTracker:
+    """
+    Measures the peak memory use of parts of the processing of a file. In "rss" mode, this is the
+    peak resident set size of the whole process, which is what matters when deciding how many
+    workers fit in memory. It's read from the kernel where the peak can be reset (Linux), and
+    sampled from a thread otherwise. In "tracemalloc" mode, it's the peak of the memory
+    allocated by python during the part, on top of what was allocated before. This is more
+    precise, but makes processing a lot slower.
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+
+        if mode == "tracemalloc":
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    @contextmanager
+    def track(self, context, name):
+        if self.mode == "tracemalloc":
+            import tracemalloc
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            try:
+                yield
+            finally:
+                peak = tracemalloc.get_traced_memory()[1] - before
+                self.record(context, name, peak)
+
+        elif reset_peak_rss():
+            try:
+                yield
+            finally:
+                self.record(context, name, peak_rss())
+
+        else:
+            samples = [current_rss() or 0]
+            done = threading.Event()
+
+            def sample():
+                while not done.wait(MEMORY_SAMPLE_INTERVAL):
+                    samples.append(current_rss() or 0)
+
+            sampler = threading.Thread(target=sample, daemon=True)
+            sampler.start()
+            try:
+                yield
+            finally:
+                done.set()
+                sampler.join()
+                samples.append(current_rss() or 0)
+                self.record(context, name, max(samples) or None)
+
+    @staticmethod
+    def record(context, name, peak):
+        if peak is None:
+            return
+        context.memory[name] = max(peak, context.memory.get(name, 0))
+        context.peak_memory = max(peak, context.peak_memory or 0)
+
+
+def read_memory_history(path):
+    """
+    Reads the peak memory use of files from an earlier report (see --report and
+    --track-memory), as {resolved path: bytes}.
+    """
+    import json
+
+    history = {}
+    with open(path, encoding='utf-8') as report_file:
+        for line in report_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("type") == "file" and record.get("peak_memory"):
+                history[str(Path(record["path"]).resolve())] = record["peak_memory"]
+    return history
+
+
+def timeout_context(filename, message):
+    context = Context(filename)
+    context.set_state('timeout')
+    context.log(f'{message} while processing {filename}. It was skipped.')
+    return context
+
+
+def run_with_soft_timeout(worker, task, soft_timeout):
+    """
+    Runs worker(task) and returns its result, or None if it was interrupted for running longer
+    than soft_timeout seconds.
+    """
+    lock = threading.Lock()
+    done = False
+
+    def interrupt():
+        # under the lock, so a worker that has already returned is never interrupted
+        with lock:
+            if not done:
+                _thread.interrupt_main()
+
+    timer = threading.Timer(soft_timeout, interrupt)
+    result = None
+    try:
+        timer.start()
+        try:
+            result = worker(task)
+        finally:
+            with lock:
+                done = True
+            timer.cancel()
+            timer.join()
+    except KeyboardInterrupt:
+        # If the timer fired just as the worker returned, the interrupt arrives here, and the
+        # finished result is kept.
+        pass
+    return result
+
+
+def remove_temp_files(filename, pid):
+    """
+    Removes the temporary files that `atomic_open` in process pid left next to filename, after
+    that process was killed while processing it.
+    """
+    for temp in Path(filename).parent.glob(f'*.{pid}.tmp'):
+        try:
+            temp.unlink()
+        except OSError:
+            pass
+
+
+def supervised_worker(conn, worker, soft_timeout):
+    """
+    Main loop of a process started by `run_supervised`. Receives (common_args, private_arg)
+    tuples over conn, and sends back the `Context` returned by worker together with the resident
+    set size of this process afterwards. A None task ends the loop.
+
+    When soft_timeout is set, a task that runs longer than it is interrupted from a timer thread,
+    and a `Context` with the timeout state is sent back instead.
+    """
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+
+        if soft_timeout is None:
+            result = worker(task)
+        else:
+            result = run_with_soft_timeout(worker, task, soft_timeout)
+            if result is None:
+                result = timeout_context(task[1], f'Soft time limit of {soft_timeout}s exceeded')
+
+        conn.send((result, current_rss()))
+
+
+class SupervisedProcess:
+    """
+    A worker process that runs one task at a time, so it can be killed on its own if that task
+    takes too long.
+    """
+
+    def __init__(self, worker, soft_timeout):
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=supervised_worker,
+                               args=(child_conn, worker, soft_timeout), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        self.task = None
+        self.started = None
+        # amount of tasks finished, and the resident set size after the last one
+        self.tasks = 0
+        self.rss = 0
+
+    def submit(self, task):
+        self.task = task
+        self.started = time.monotonic()
+        self.conn.send(task)
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+def run_supervised(worker, worker_args, parallelism, soft_timeout=None, hard_timeout=None,
+                   max_tasks=None, memory_budget=None, task_memory=None):
+    """
+    Like `Pool.imap_unordered`, but with time limits per task. A task exceeding soft_timeout is
+    interrupted inside its worker. A worker exceeding hard_timeout is killed and replaced, and a
+    `Context` with the timeout state is produced for its task.
+
+    Workers are replaced after max_tasks tasks. memory_budget (in bytes) is shared between the
+    workers: one that grows past its share is replaced after its task, and no new tasks are
+    started while the busy workers use the whole budget or the system is low on memory. At
+    least one task is always running, so progress is guaranteed. task_memory can map the files
+    of tasks to the peak memory they are known to need (see `read_memory_history`), which is
+    then used instead of the share of a worker, so known heavy files don't run at the same time.
+    """
+    worker_args = iter(worker_args)
+    idle = [SupervisedProcess(worker, soft_timeout) for _ in range(parallelism)]
+    busy = {}
+    worker_memory = None if memory_budget is None else memory_budget // parallelism
+    task_memory = task_memory or {}
+    # a task that had to wait for memory to become available
+    pending = None
+
+    def expected_memory(task):
+        return task_memory.get(str(task[1]), worker_memory)
+
+    def memory_allows_task(task):
+        if worker_memory is None or not busy:
+            return True
+
+        needed = expected_memory(task)
+        in_use = sum(max(process.rss, task_memory.get(str(process.task[1]), 0))
+                     for process in busy.values())
+        if in_use + needed > memory_budget:
+            return False
+
+        available = available_memory()
+        return available is None or available > needed
+
+    try:
+        while True:
+            while idle:
+                task = pending if pending is not None else next(worker_args, None)
+                if task is None:
+                    break
+                if not memory_allows_task(task):
+                    pending = task
+                    break
+                pending = None
+                process = idle.pop()
+                process.submit(task)
+                busy[process.conn] = process
+
+            if not busy:
+                break
+
+            deadline = None
+            if hard_timeout is not None:
+                deadline = max(0, min(process.started for process in busy.values())
+                               + hard_timeout - time.monotonic())
+
+            for conn in wait(list(busy), deadline):
+                process = busy.pop(conn)
+                try:
+                    result, rss = conn.recv()
+                except EOFError:
+                    # the process died without answering, most likely killed by the os.
+                    result = Context(process.task[1])
+                    result.log(f'Worker process died while processing {process.task[1]}.')
+                    process.kill()
+                    remove_temp_files(process.task[1], process.process.pid)
+                    process = SupervisedProcess(worker, soft_timeout)
+                else:
+                    process.tasks += 1
+                    process.rss = rss or 0
+                    if ((max_tasks is not None and process.tasks >= max_tasks)
+                            or (worker_memory is not None and process.rss > worker_memory)):
+                        # recycle the process, returning its memory to the os
+                        process.close()
+                        process = SupervisedProcess(worker, soft_timeout)
+                idle.append(process)
+                yield result
+
+            if hard_timeout is not None:
+                now = time.monotonic()
+                for conn, process in list(busy.items()):
+                    if now - process.started >= hard_timeout:
+                        del busy[conn]
+                        process.kill()
+                        remove_temp_files(process.task[1], process.process.pid)
+                        idle.append(SupervisedProcess(worker, soft_timeout))
+                        yield timeout_context(
+                            process.task[1], f'Hard time limit of {hard_timeout}s exceeded')
+
+    finally:
+        for process in busy.values():
+            process.kill()
+            remove_temp_files(process.task[1], process.process.pid)
+        for process in idle:
+            process.close()
+
+
+def run_workers(worker, common_args, private_args, parallelism,
+                soft_timeout=None, hard_timeout=None, max_tasks=None, memory_budget=None,
+                journal=None, task_memory=None):
     """
     Runs worker in parallel using multiprocessing, with a max of `parallelism` processes.
     Workers are called as worker((common_args, private_args[i])).
-    Workers should return an instance of `Context` as return value.
+    Workers should return an instance of `Context` as return value. If a `Journal` is given,
+    every result is recorded in it as soon as it arrives.
+
+    If soft_timeout or hard_timeout (in seconds), max_tasks or memory_budget (in bytes) are
+    given, every file is processed by supervised worker processes that enforce these limits
+    (see `run_supervised`), even when parallelism is 1. task_memory is passed on to it.
     """
 
     worker_args = ((common_args, x) for x in private_args)
 
     results = []
-    if parallelism > 1:
-        with Pool(parallelism) as pool:
-            for result in pool.imap(worker, worker_args, 1):
-                results.append(result)
 
-                for line in result.log_contents:
-                    print(line)
+    def report(result):
+        results.append(result)
 
-                print("")
+        if journal is not None:
+            journal.record(result)
 
-    else:
-        for result in map(worker, worker_args):
-            results.append(result)
+        for line in result.log_contents:
+            print(line)
+
+        print("")
+
+    if any(limit is not None for limit in (soft_timeout, hard_timeout, max_tasks, memory_budget)):
+        for result in run_supervised(worker, worker_args, parallelism, soft_timeout,
+                                     hard_timeout, max_tasks, memory_budget, task_memory):
+            report(result)
 
-            for line in result.log_contents:
-                print(line)
+    elif parallelism > 1:
+        with Pool(parallelism) as pool:
+            for result in pool.imap(worker, worker_args, 1):
+                report(result)
 
-            print("")
+    else:
+        for result in map(worker, worker_args):
+            report(result)
 
     return results
 
@@ -359,6 +1624,67 @@ def main():
         action="store_true",
         help="Tries some workarounds against common obfuscation methods. This is a lot slower.")
 
+    ap.add_argument(
+        '--soft-timeout',
+        dest='soft_timeout',
+        type=float,
+        action='store',
+        help="Interrupt the decompilation of any single file after this many seconds, and "
+        "mark it as timed out.")
+
+    ap.add_argument(
+        '--hard-timeout',
+        dest='hard_timeout',
+        type=float,
+        action='store',
+        help="Kill and replace the worker process handling a file after this many seconds, for "
+        "files that cannot be interrupted by --soft-timeout.")
+
+    ap.add_argument(
+        '--max-tasks-per-worker',
+        dest='max_tasks',
+        type=int,
+        action='store',
+        help="Replace each worker process after it has handled this many files, returning any "
+        "memory it accumulated to the system.")
+
+    ap.add_argument(
+        '--memory-budget',
+        dest='memory_budget',
+        type=int,
+        action='store',
+        help="The amount of memory in MB that all worker processes together may use. Workers "
+        "growing past their share are replaced, and fewer files are processed at the same time "
+        "when the budget is used up or the system runs low on memory.")
+
+    ap.add_argument(
+        '--track-memory',
+        dest='track_memory',
+        choices=['rss', 'tracemalloc'],
+        action='store',
+        help="Measures the peak memory used while loading and decompiling every file, and "
+        "summarizes it at the end. 'rss' measures the memory of the whole worker process and is "
+        "cheap, 'tracemalloc' measures the memory allocated for the file itself, but is slow. "
+        "The peaks are included in the report when using '--report'.")
+
+    ap.add_argument(
+        '--memory-history',
+        dest='memory_history',
+        type=str,
+        action='store',
+        help="Reads the peak memory of files from the report of an earlier run with "
+        "'--track-memory'. With '--memory-budget', files known to need a lot of memory are then "
+        "not processed at the same time when they wouldn't fit in the budget together.")
+
+    ap.add_argument(
+        '--profiles',
+        dest='profiles',
+        type=str,
+        action='store',
+        help="Loads extra deobfuscation profiles from every python file in the given directory. "
+        "Profiles are matched on a fingerprint of the file before the generic --try-harder "
+        "strategies are tried.")
+
     ap.add_argument(
         '-p',
         '--processes',
@@ -371,6 +1697,131 @@ def main():
         "Defaults to the amount of hw threads available minus one, disabled when muliprocessing "
         "unavailable is.")
 
+    ap.add_argument(
+        '--file-processes',
+        dest='file_processes',
+        action='store',
+        type=int,
+        default=1,
+        help="Use the specified number of processes to decompile the top level statements of a "
+        "single large file in parallel. The output is identical to normal decompilation. Only "
+        "applies to files that are decompiled in the main process, so when there is only one "
+        "file, or when using '-p 1' without any worker limits.")
+
+    ap.add_argument(
+        '--cache-dir',
+        dest='cache_dir',
+        type=str,
+        action='store',
+        help="Keeps decompiled scripts in the given directory, addressed by the contents of the "
+        "rpyc file and the options used. Files that were decompiled before are then copied from "
+        "the cache instead of being decompiled again.")
+
+    ap.add_argument(
+        '--cache-size',
+        dest='cache_size',
+        type=int,
+        action='store',
+        default=1024,
+        help="The size in MB the cache directory may grow to. The least recently used entries "
+        "are removed at the end of a run when it is larger. Defaults to 1024 MB.")
+
+    ap.add_argument(
+        '--incremental',
+        dest='incremental',
+        action='store_true',
+        help=f"Records how every file was decompiled in a manifest ({MANIFEST_NAME}). Later "
+        "runs with this flag only decompile files that changed since, or were decompiled with "
+        "different options or another version of unrpyc, and overwrite their outdated output. "
+        "Existing output files the manifest didn't record are still only overwritten with "
+        "--clobber. Each input path uses the nearest manifest in it or its parent directories, "
+        "or gets a new one in its root, unless '--manifest' is given.")
+
+    ap.add_argument(
+        '--manifest',
+        dest='manifest',
+        type=str,
+        action='store',
+        help="The manifest file '--incremental' uses for all input files.")
+
+    ap.add_argument(
+        '--journal',
+        dest='journal',
+        type=str,
+        action='store',
+        help="Records the outcome of every file in the given file as soon as it is known, so an "
+        "interrupted run can be continued with '--resume'.")
+
+    ap.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        help="Continues the run recorded in the journal given with '--journal', only processing "
+        "the files that it didn't finish.")
+
+    ap.add_argument(
+        '--report',
+        dest='report',
+        type=str,
+        action='store',
+        help="Writes a machine readable report of the run to the given file, as json lines: "
+        "a record per processed file with its state, timings, sizes, warnings and errors, "
+        "followed by a summary record with the throughput of the whole run.")
+
+    ap.add_argument(
+        '-v',
+        '--verbose',
+        dest='verbose',
+        action='store_true',
+        help="Shows the time spent in each stage of decompilation at the end of the run, in "
+        "total and per file. This is always shown when using '--report'.")
+
+    ap.add_argument(
+        '--profile-slow',
+        dest='profile_slow',
+        type=float,
+        action='store',
+        help="Processes every file under cProfile, and keeps the profiles of the files that take "
+        "longer than the given amount of seconds to process. Processing is slower while doing "
+        "so, which counts towards the time. Their profiles are written to the profile directory "
+        "as a .prof file and a .txt listing, named after the file.")
+
+    ap.add_argument(
+        '--profile-all',
+        dest='profile_all',
+        action='store_true',
+        help="Processes every file under cProfile, and combines their profiles into "
+        "unrpyc-all.prof (and a .txt listing) in the profile directory.")
+
+    ap.add_argument(
+        '--node-stats',
+        dest='node_stats',
+        action='store_true',
+        help="Counts and times the statements printed by the decompiler per AST class and per "
+        "handler, and shows the most expensive ones at the end of the run. Decompilation is "
+        "slower while doing so. When using '--file-processes', only the statements decompiled "
+        "in the main process are counted.")
+
+    ap.add_argument(
+        '--profile-dir',
+        dest='profile_dir',
+        type=str,
+        action='store',
+        help="The directory profiles are written to. Defaults to the directory of the report "
+        "when using '--report', and the current directory otherwise.")
+
+    ap.add_argument(
+        '--only',
+        dest='only',
+        action='store',
+        type=str,
+        default=None,
+        help="Only decompile the selected statements, given as a comma separated list of "
+        "'label:name', 'screen:name', 'transform:name' or 'image:name' selectors, for example "
+        "'--only label:start,screen:main_menu'. The top level statements containing them are "
+        "written next to the input as <name>.only.rpy, so the full output is left alone. Files "
+        "containing none of them are skipped.")
+
     astdump = ap.add_argument_group('astdump options', 'All unrpyc options related to ast-dumping.')
     astdump.add_argument(
         '-d',
@@ -438,6 +1889,45 @@ def main():
     if args.dump and args.translate:
         ap.error("Options '--translate' and '--dump' cannot be used together.")
 
+    if (args.soft_timeout is not None and args.hard_timeout is not None
+            and args.soft_timeout >= args.hard_timeout):
+        ap.error("Option '--soft-timeout' must be smaller than '--hard-timeout'.")
+
+    if args.profiles and not args.try_harder:
+        ap.error("Option '--profiles' requires '--try-harder'.")
+
+    # Loaded here first, so broken profiles stop the run instead of failing files. Forked workers
+    # start out with them loaded.
+    if args.profiles:
+        if not Path(args.profiles).is_dir():
+            ap.error(f"The profiles directory {args.profiles} does not exist.")
+        import deobfuscate
+        try:
+            deobfuscate.load_profiles(args.profiles)
+        except Exception:
+            ap.error(f"Could not load the profiles in {args.profiles}:\n"
+                     f"{traceback.format_exc()}")
+
+    if args.resume and not args.journal:
+        ap.error("Option '--resume' requires '--journal'.")
+
+    if args.manifest and not args.incremental:
+        ap.error("Option '--manifest' requires '--incremental'.")
+
+    if args.profile_slow is not None or args.profile_all:
+        if args.profile_dir is None:
+            args.profile_dir = Path(args.report).parent if args.report else Path.cwd()
+        args.profile_dir = str(Path(args.profile_dir).resolve())
+        Path(args.profile_dir).mkdir(parents=True, exist_ok=True)
+
+    if args.only is not None:
+        if args.dump:
+            ap.error("Options '--only' and '--dump' cannot be used together.")
+        try:
+            args.only = decompiler.parse_selectors(args.only)
+        except ValueError as e:
+            ap.error(str(e))
+
     if args.sl_custom_names is not None:
         try:
             args.sl_custom_names = parse_sl_custom_names(args.sl_custom_names)
@@ -466,10 +1956,14 @@ def main():
     # Check paths from argparse through globing and pathlib. Constructs a tasklist with all
     # `Ren'Py compiled files` the app was assigned to process.
     worklist = []
+    # the input path each file was found through, see --incremental
+    input_roots = {}
     for entry in args.file:
         for globitem in glob_or_complain(entry):
+            root = globitem if globitem.is_dir() else globitem.parent
             for elem in traverse(globitem):
                 worklist.append(elem)
+                input_roots.setdefault(elem, root)
 
     # Check if we actually have files. Don't worry about no parameters passed,
     # since ArgumentParser catches that
@@ -485,7 +1979,9 @@ def main():
 
     # If a big file starts near the end, there could be a long time with only one thread running,
     # which is inefficient. Avoid this by starting big files first.
-    worklist.sort(key=lambda x: x.stat().st_size, reverse=True)
+    sort_by_cost(worklist, args.try_harder)
+
+    memory_budget = None if args.memory_budget is None else args.memory_budget * 1024 * 1024
 
     translation_errors = 0
     args.translator = None
@@ -499,7 +1995,8 @@ def main():
         # these). Therefore, we need to manually pickle and unpickle it.
 
         print("Step 1: analysing files for translations.")
-        results = run_workers(worker_tl, args, worklist, args.processes)
+        results = run_workers(worker_tl, args, worklist, args.processes,
+                              args.soft_timeout, args.hard_timeout, args.max_tasks, memory_budget)
 
         print('Compiling extracted translations.')
         tl_dialogue = {}
@@ -513,6 +2010,7 @@ def main():
                 tl_dialogue.update(new_dialogue)
                 tl_strings.update(new_strings)
 
+        from decompiler import translate
         translator = translate.Translator(None)
         translator.dialogue = tl_dialogue
         translator.strings = tl_strings
@@ -520,12 +2018,107 @@ def main():
 
         print("Step 2: decompiling.")
 
-    results = run_workers(worker_common, args, worklist, args.processes)
+    unchanged = 0
+    # input files whose existing output may be overwritten even without --clobber
+    args.replace_outputs = frozenset()
+    if args.incremental:
+        # every file goes in the manifest of the input path it was found through, or in the one
+        # given with --manifest
+        manifests = {}
+        file_manifests = {}
+        for filename in worklist:
+            path = (Path(args.manifest).resolve() if args.manifest
+                    else Manifest.find(input_roots[filename]))
+            if path not in manifests:
+                manifests[path] = Manifest(path)
+            file_manifests[filename] = manifests[path]
+
+        translator_digest = None
+        if args.translator:
+            import hashlib
+            translator_digest = hashlib.sha256(args.translator).hexdigest()
+        options = Manifest.options_digest(
+            dump=args.dump, comparable=args.comparable, no_pyexpr=args.no_pyexpr,
+            translator=translator_digest, init_offset=args.init_offset,
+            sl_custom_names=args.sl_custom_names, only=args.only)
+
+        outdated = [filename for filename in worklist
+                    if not file_manifests[filename].is_current(filename, options, args.dump,
+                                                               args.only is not None)]
+        unchanged = len(worklist) - len(outdated)
+        worklist = outdated
+        # The output of outdated files is stale, so it has to be replaced. Outputs the manifest
+        # doesn't know about weren't written by unrpyc, and are only replaced with --clobber.
+        args.replace_outputs = frozenset(filename for filename in outdated
+                                         if file_manifests[filename].owns_output(filename))
+
+    journal = None
+    resumed = 0
+    if args.journal:
+        journal = Journal(args.journal, args.resume)
+        finished = journal.finished_files()
+        remaining = [filename for filename in worklist if str(filename.resolve()) not in finished]
+        resumed = len(worklist) - len(remaining)
+        worklist = remaining
+
+    report = None
+    if args.report:
+        report = Report(args.report, __title__, files=len(worklist), processes=args.processes,
+                        try_harder=args.try_harder, cache=bool(args.cache_dir),
+                        incremental=args.incremental, resume=args.resume)
+
+    try:
+        task_memory = None
+        if args.memory_history:
+            task_memory = read_memory_history(args.memory_history)
+
+        results = run_workers(worker_common, args, worklist, args.processes, args.soft_timeout,
+                              args.hard_timeout, args.max_tasks, memory_budget, journal,
+                              task_memory)
+    finally:
+        if journal is not None:
+            journal.close()
+
+    if args.incremental:
+        for result in results:
+            if result.state == "ok":
+                file_manifests[result.filename].record(result.filename, options)
+        for manifest in manifests.values():
+            manifest.save()
+
+    if args.profile_slow is not None:
+        profile_slow_files(args, results)
+    all_profile = merge_profiles(args.profile_dir) if args.profile_all else None
+    slow_profiles = sum(result.profile is not None for result in results)
+
+    node_stats = None
+    for result in results:
+        if result.node_stats is not None:
+            node_stats = node_stats or decompiler.NodeStats()
+            node_stats.merge(result.node_stats)
+
+    if report is not None:
+        report.close([report.file_record(result, args.dump, args.only is not None)
+                      for result in results],
+                     unchanged=unchanged, resumed=resumed,
+                     profile=None if all_profile is None else str(all_profile),
+                     node_stats=None if node_stats is None else dict(
+                         classes=node_stats.classes, handlers=node_stats.handlers,
+                         states={str(name): counts
+                                 for name, counts in node_stats.states.items()}))
 
     success = sum(result.state == "ok" for result in results)
     skipped = sum(result.state == "skip" for result in results)
     failed = sum(result.state == "error" for result in results)
     broken = sum(result.state == "bad_header" for result in results)
+    timed_out = sum(result.state == "timeout" for result in results)
+    unselected = sum(result.state == "unselected" for result in results)
+    cache_hits = sum(result.cache == "hit" for result in results)
+    cache_misses = sum(result.cache == "miss" for result in results)
+
+    cache_evicted = 0
+    if args.cache_dir:
+        cache_evicted = DecompilationCache(args.cache_dir).evict(args.cache_size * 1024 * 1024)
 
     print("")
     print(f"{55 * '-'}")
@@ -533,6 +2126,12 @@ def main():
     print(f"{55 * '-'}")
     print(f"Processed {plural_s(len(results), 'file')}.")
 
+    if unchanged:
+        print(f"> {plural_s(unchanged, 'file')} were unchanged since the last run.")
+
+    if resumed:
+        print(f"> {plural_s(resumed, 'file')} were already processed before the run was resumed.")
+
     print(f"> {plural_s(success, 'file')} were successfully decompiled.")
 
     if broken:
@@ -545,9 +2144,51 @@ def main():
     if skipped:
         print(f"> {plural_s(skipped, 'file')} were skipped as the output file already existed.")
 
+    if timed_out:
+        print(f"> {plural_s(timed_out, 'file')} exceeded the time limit and were skipped.")
+
+    if unselected:
+        print(f"> {plural_s(unselected, 'file')} contained none of the selected statements.")
+
     if translation_errors:
         print(f"> {plural_s(translation_errors, 'file')} failed translation extraction.")
 
+    if slow_profiles:
+        print(f"> {plural_s(slow_profiles, 'file')} took longer than {args.profile_slow}s, "
+              f"their profiles were written to {args.profile_dir}.")
+
+    if all_profile is not None:
+        print(f"> The combined profile of all files was written to {all_profile}.")
+
+    timings = timing_summary(results) if args.report or args.verbose else None
+    if timings:
+        print("")
+        print("Time spent per stage, in total and per file:")
+        for line in timings:
+            print(line)
+
+    if node_stats is not None:
+        print("")
+        print("Decompilation time per statement type, by own time:")
+        for line in node_stats.summary():
+            print(line)
+
+    memory = memory_summary(results)
+    if memory:
+        print("")
+        print("Peak memory per file:")
+        for line in memory:
+            print(line)
+
+    if cache_hits or cache_misses:
+        print(f"> {plural_s(cache_hits, 'file')} were taken from the cache, "
+              f"{plural_s(cache_misses, 'file')} were not "
+              f"({cache_hits / (cache_hits + cache_misses):.0%} hit rate).")
+
+    if cache_evicted:
+        print(f"> {plural_s(cache_evicted, 'file')} were removed from the cache to keep it within "
+              f"{args.cache_size} MB.")
+
 
     if skipped:
         print("")
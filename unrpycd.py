@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2012-2024 Yuri K. Schlesner, CensoredUsername, Jackmcbarn
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# A long running decompilation daemon, and the client for it.
+#
+# `unrpycd.py serve` imports the decompiler and starts a pool of worker processes once, and then
+# accepts jobs on a unix socket or a local http port. `unrpycd.py submit` sends jobs to it, so
+# every job only pays for the actual decompilation. The client only uses the standard library
+# and doesn't import the decompiler, to keep its own startup fast.
+#
+# Jobs and results are JSON objects. On the unix socket, both are sent one per line, and a client
+# can send any amount of jobs over one connection. Results are sent back as soon as they're done,
+# in any order, and the connection is closed after the client has shut down its sending side and
+# all its jobs are done. Over http, jobs are POSTed as one JSON object or a list of them, and the
+# results are streamed back one per line in the same way.
+#
+# A job is one of:
+#     {"id": ..., "rpyc": path}    decompile the file at path next to it, like unrpyc.py
+#     {"id": ..., "data": base64}  decompile the given rpyc file contents, returning the text
+#     {"id": ..., "apk": path}     extract the apk like renpy-unapk.py and decompile its scripts
+# and can have an "options" object with clobber, try_harder, init_offset and only (as given to
+# --only), which override the defaults the daemon was started with.
+#
+# Each result has the id of its job, its state (as in unrpyc.Context, or the count of files in
+# each state for apk jobs), the log, the text for data jobs, and per-job stats in milliseconds:
+# the time spent waiting for a worker, running, and in total. Results of rpyc jobs also have the
+# wall and cpu time in seconds spent in each stage (as in unrpyc.Context.timings).
+#
+# Jobs name arbitrary paths, which the daemon reads and writes next to with the permissions of
+# the user running it. The unix socket is therefore created in a directory only that user can
+# access ($XDG_RUNTIME_DIR, or a private directory in the temp directory), and only that user can
+# connect to it. The http listener has no authentication at all: every local user and process
+# that can reach the port can submit jobs. Only use --http on single-user machines, and never
+# bind it to anything but a loopback address.
+
+import argparse
+import base64
+import getpass
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+DEFAULT_HTTP = "127.0.0.1:8765"
+
+
+def default_socket():
+    # a per-user directory, as the socket lets anyone who can connect to it read and write files
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        user = os.getuid() if hasattr(os, "getuid") else getpass.getuser()
+        runtime_dir = os.path.join(tempfile.gettempdir(), f"unrpycd-{user}")
+    return os.path.join(runtime_dir, "unrpycd.sock")
+
+
+def private_directory(path):
+    """
+    Creates the directory at path, accessible only to the current user, or checks that an existing
+    one is. Raises an exception if it belongs to someone else or others can access it.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not hasattr(os, "getuid"):
+        return
+    info = os.stat(path)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise Exception(f"{path} must belong to the current user, and only be accessible to it.")
+
+# the options jobs can override
+JOB_OPTIONS = ("clobber", "try_harder", "init_offset", "only")
+
+
+# Worker side. These run in the pool, where unrpyc has already been imported.
+
+def job_args(options):
+    # the argument namespace unrpyc.worker_common expects
+    import decompiler
+    import unrpyc
+
+    only = options["only"]
+    return unrpyc.default_args(
+        clobber=options["clobber"], try_harder=options["try_harder"],
+        init_offset=options["init_offset"], profiles=options.get("profiles"),
+        only=None if only is None else decompiler.parse_selectors(only))
+
+
+def run_job(kind, payload, options):
+    """
+    Runs a single "rpyc" or "data" job. Returns the fields of its result.
+    """
+    import unrpyc
+
+    started = time.time()
+
+    if kind == "rpyc":
+        context = unrpyc.worker_common((job_args(options), Path(payload)))
+        result = {"state": context.state, "log": context.log_contents,
+                  "timings": context.timings}
+
+    else:
+        try:
+            args = job_args(options)
+            decompiled = unrpyc.decompile(
+                base64.b64decode(payload), try_harder=args.try_harder,
+                init_offset=args.init_offset, only=args.only)
+        except Exception as e:
+            result = {"state": "error", "log": [f'Error while decompiling: {e!r}']}
+        else:
+            result = {"state": "ok", "text": decompiled.text,
+                      "log": [warning.message for warning in decompiled.warnings],
+                      "warnings": [{"stage": warning.stage, "message": warning.message}
+                                   for warning in decompiled.warnings]}
+
+    result["started"] = started
+    result["run_ms"] = round((time.time() - started) * 1000, 3)
+    result["pid"] = os.getpid()
+    return result
+
+
+# Daemon side
+
+class Daemon:
+    """
+    Holds the warm worker pool, and turns jobs into results.
+    """
+
+    def __init__(self, args):
+        from multiprocessing import Pool, cpu_count
+        # importing these here means forked workers start out with them loaded
+        import unrpyc  # noqa
+
+        if args.profiles:
+            import deobfuscate
+            deobfuscate.load_profiles(args.profiles)
+
+        self.defaults = {"clobber": args.clobber, "try_harder": args.try_harder,
+                         "init_offset": args.init_offset, "only": None,
+                         "profiles": args.profiles}
+        self.processes = args.processes or cpu_count()
+        self.pool = Pool(self.processes, maxtasksperchild=args.max_tasks)
+
+        # renpy-unapk extracts through a fixed temporary folder, so apks go one at a time
+        self.apk_lock = threading.Lock()
+        self.unapk = None
+
+        self.jobs_done = 0
+
+    def options(self, job):
+        options = dict(self.defaults)
+        for key, value in (job.get("options") or {}).items():
+            if key in JOB_OPTIONS:
+                options[key] = value
+        return options
+
+    def submit(self, job, callback):
+        """
+        Starts working on job, and calls callback with its result once it's done. This can happen
+        on any thread.
+        """
+        submitted = time.time()
+
+        def finish(result):
+            result["id"] = job.get("id")
+            result["queue_ms"] = round((result.pop("started", submitted) - submitted) * 1000, 3)
+            result["total_ms"] = round((time.time() - submitted) * 1000, 3)
+            self.jobs_done += 1
+            callback(result)
+
+        def fail(e):
+            finish({"state": "error", "log": [f'Error while handling job: {e!r}']})
+
+        try:
+            options = self.options(job)
+            if "apk" in job:
+                thread = threading.Thread(
+                    target=self.run_apk, args=(job["apk"], options, finish, fail), daemon=True)
+                thread.start()
+                return
+
+            kind = "rpyc" if "rpyc" in job else "data"
+            self.pool.apply_async(run_job, (kind, job[kind], options),
+                                  callback=finish, error_callback=fail)
+
+        except Exception as e:
+            fail(e)
+
+    def run_apk(self, apk_path, options, finish, fail):
+        try:
+            started = time.time()
+            with self.apk_lock:
+                if self.unapk is None:
+                    self.unapk = load_unapk().RenPyUnapk()
+                game_folder = self.unapk.extract_apk(Path(apk_path))
+
+            rpyc_files = list(game_folder.rglob('*.rpyc')) + list(game_folder.rglob('*.rpymc'))
+            import unrpyc
+            unrpyc.sort_by_cost(rpyc_files, options["try_harder"])
+
+            pending = [self.pool.apply_async(run_job, ("rpyc", str(filename), options))
+                       for filename in rpyc_files]
+
+            states = {}
+            log = []
+            for async_result in pending:
+                result = async_result.get()
+                states[result["state"]] = states.get(result["state"], 0) + 1
+                log.extend(result["log"])
+
+            finish({"state": states, "log": log, "files": len(rpyc_files), "started": started,
+                    "run_ms": round((time.time() - started) * 1000, 3),
+                    "output": str(game_folder)})
+
+        except Exception as e:
+            fail(e)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+def load_unapk():
+    # renpy-unapk.py can't be imported by name
+    import importlib.util
+
+    spec = importlib.util.spec_from_file_location(
+        "renpy_unapk", Path(__file__).resolve().parent / "renpy-unapk.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ResultStream:
+    """
+    Collects the results of the jobs submitted over one connection, so they can be sent back
+    from the thread handling it.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.results = []
+        self.pending = 0
+
+    def add_job(self):
+        with self.condition:
+            self.pending += 1
+
+    def put(self, result):
+        with self.condition:
+            self.results.append(result)
+            self.pending -= 1
+            self.condition.notify()
+
+    def get(self, finished):
+        # waits for results. Returns an empty list once finished() and nothing is pending
+        with self.condition:
+            while not self.results and (self.pending or not finished()):
+                self.condition.wait(0.1)
+            results, self.results = self.results, []
+            return results
+
+
+def serve_stream(daemon, lines, write):
+    """
+    Reads jobs from the iterable of lines on a separate thread and submits them, while writing
+    the results back as they come in. Returns once all jobs are done.
+    """
+    stream = ResultStream()
+    done_reading = threading.Event()
+
+    def read():
+        try:
+            for line in lines:
+                if not line.strip():
+                    continue
+                stream.add_job()
+                try:
+                    job = json.loads(line)
+                except ValueError as e:
+                    stream.put({"id": None, "state": "error", "log": [f'Bad job: {e}']})
+                    continue
+                daemon.submit(job, stream.put)
+        finally:
+            done_reading.set()
+
+    threading.Thread(target=read, daemon=True).start()
+
+    while True:
+        results = stream.get(done_reading.is_set)
+        if not results:
+            return
+        for result in results:
+            write((json.dumps(result) + "\n").encode("utf-8"))
+
+
+def serve(args):
+    import socketserver
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    daemon = Daemon(args)
+
+    class StreamHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            serve_stream(daemon, self.rfile, self.wfile.write)
+
+    class HTTPHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.0"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                jobs = json.loads(body)
+            except ValueError as e:
+                self.send_error(400, f'Bad job: {e}')
+                return
+            if not isinstance(jobs, list):
+                jobs = [jobs]
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            serve_stream(daemon, (json.dumps(job) for job in jobs), self.wfile.write)
+
+        def do_GET(self):
+            # a cheap way to check if the daemon is up
+            body = json.dumps({"jobs_done": daemon.jobs_done}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    if args.http:
+        host, _, port = args.http.rpartition(":")
+        host = host or "127.0.0.1"
+        if host not in ("127.0.0.1", "::1", "localhost"):
+            print(f"Warning: {host} is not a loopback address. Anyone who can reach it can make "
+                  "the daemon read and write any file this user can.", file=sys.stderr)
+        server = ThreadingHTTPServer((host, int(port)), HTTPHandler)
+        where = f'http://{host}:{port}'
+    else:
+        private_directory(os.path.dirname(os.path.abspath(args.socket)))
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        # only the current user may connect, from the moment the socket exists
+        umask = os.umask(0o177)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(args.socket, StreamHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(args.socket, 0o600)
+        where = args.socket
+    server.daemon_threads = True
+
+    print(f"unrpycd listening on {where} with {daemon.processes} workers.", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+        if not args.http and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+# Client side
+
+def make_job(number, item, options):
+    job = {"id": number}
+    if item == "-":
+        job["data"] = base64.b64encode(sys.stdin.buffer.read()).decode("ascii")
+    elif item.lower().endswith(".apk"):
+        job["apk"] = os.path.abspath(item)
+    else:
+        job["rpyc"] = os.path.abspath(item)
+    if options:
+        job["options"] = options
+    return job
+
+
+def submit(args):
+    options = {}
+    if args.clobber:
+        options["clobber"] = True
+    if args.try_harder:
+        options["try_harder"] = True
+    if args.only:
+        options["only"] = args.only
+
+    jobs = [make_job(i, item, options) for i, item in enumerate(args.items)]
+
+    if args.http:
+        import http.client
+
+        host, _, port = args.http.rpartition(":")
+        connection = http.client.HTTPConnection(host or "127.0.0.1", int(port))
+        connection.request("POST", "/", json.dumps(jobs),
+                           {"Content-Type": "application/json"})
+        lines = connection.getresponse()
+
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(args.socket)
+        connection.sendall("".join(json.dumps(job) + "\n" for job in jobs).encode("utf-8"))
+        connection.shutdown(socket.SHUT_WR)
+        lines = connection.makefile("rb")
+
+    failed = 0
+    for line in lines:
+        result = json.loads(line)
+        state = result["state"]
+        states = state if isinstance(state, dict) else {state: 1}
+        if set(states) - {"ok", "skip"}:
+            failed += 1
+
+        if args.json:
+            print(line.decode("utf-8"), end="")
+            continue
+
+        if "text" in result:
+            sys.stdout.write(result["text"])
+        for message in result["log"]:
+            print(message, file=sys.stderr)
+        item = "?" if result["id"] is None else args.items[result["id"]]
+        if "queue_ms" in result and "run_ms" in result:
+            print(f'{item}: {state} (queued {result["queue_ms"]:.1f} ms, '
+                  f'ran {result["run_ms"]:.1f} ms)', file=sys.stderr)
+        elif "queue_ms" in result:
+            # failed jobs never ran
+            print(f'{item}: {state} (after {result["total_ms"]:.1f} ms)', file=sys.stderr)
+        else:
+            print(f'{item}: {state}', file=sys.stderr)
+
+    connection.close()
+    return 1 if failed else 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Decompilation daemon for .rpyc files and apks")
+    commands = ap.add_subparsers(dest="command", required=True)
+
+    serve_ap = commands.add_parser(
+        "serve", help="Start the daemon, with a warm pool of decompilation workers.")
+    submit_ap = commands.add_parser(
+        "submit", help="Send jobs to a running daemon, and print the results as they come in.")
+
+    for command_ap in (serve_ap, submit_ap):
+        where = command_ap.add_mutually_exclusive_group()
+        where.add_argument(
+            '--socket',
+            dest='socket',
+            default=default_socket(),
+            help="The unix socket the daemon listens on (default "
+            f"{default_socket()}). Its directory must only be accessible to the current user.")
+        where.add_argument(
+            '--http',
+            dest='http',
+            default=None,
+            help="Use http on this [host:]port instead of the unix socket, "
+            f"for example {DEFAULT_HTTP}. The http listener has no authentication: any local "
+            "user or process that can reach it can make the daemon read and write any file this "
+            "user can. Only use it on single-user machines.")
+        command_ap.add_argument(
+            '-c',
+            '--clobber',
+            dest='clobber',
+            action='store_true',
+            help="Overwrites output files if they already exist.")
+        command_ap.add_argument(
+            '--try-harder',
+            dest="try_harder",
+            action="store_true",
+            help="Tries some workarounds against common obfuscation methods.")
+
+    serve_ap.add_argument(
+        '-p',
+        '--processes',
+        dest='processes',
+        type=int,
+        default=None,
+        help="Amount of worker processes to keep running (default: one per cpu).")
+    serve_ap.add_argument(
+        '--max-tasks-per-worker',
+        dest='max_tasks',
+        type=int,
+        default=None,
+        help="Replace each worker process after it has handled this many files.")
+    serve_ap.add_argument(
+        '--no-init-offset',
+        dest='init_offset',
+        action='store_false',
+        help="Don't guess init offset statements, like unrpyc.py's option.")
+    serve_ap.add_argument(
+        '--profiles',
+        dest='profiles',
+        default=None,
+        help="Directory of extra deobfuscation profiles for --try-harder.")
+
+    submit_ap.add_argument(
+        'items',
+        nargs='+',
+        help="The .rpyc/.rpymc files and apks to process. '-' sends the contents of stdin as an "
+        "rpyc file, and writes the decompiled text to stdout.")
+    submit_ap.add_argument(
+        '--only',
+        dest='only',
+        default=None,
+        help="Only decompile the selected statements, like unrpyc.py's option.")
+    submit_ap.add_argument(
+        '--json',
+        dest='json',
+        action='store_true',
+        help="Print the results as they are received, one JSON object per line.")
+
+    args = ap.parse_args()
+
+    if args.command == "serve":
+        serve(args)
+    else:
+        sys.exit(submit(args))
+
+
+if __name__ == '__main__':
+    main()